@@ -0,0 +1,39 @@
+import pandas as pd
+import reader
+
+LEVELS = range(1, 13)
+
+def level_column(level):
+    return f'HYBAS_L{level:02d}'
+
+def layer_name(level, continent='eu'):
+    return f'hybas_{continent}_lev{level:02d}_v1c'
+
+def load_hierarchy(fname, bbox, continent='eu'):
+    # HYBAS_ID of the enclosing basin at every level, for each level 12 basin. HydroBASINS levels are
+    # strictly nested Pfafstetter codes: a level n basin's PFAF_ID is the first n digits of the PFAF_ID
+    # of every level 12 basin inside it, so no geometry is needed.
+    levels = {
+        level: reader.read_layer(fname, layer=layer_name(level, continent), bbox=bbox, columns=['HYBAS_ID', 'PFAF_ID'], geometry=False)
+        for level in LEVELS
+    }
+    lev12 = levels[12]
+    hierarchy = pd.DataFrame(index=range(len(lev12)))
+    for level in LEVELS:
+        lookup = pd.Series(levels[level]['HYBAS_ID'].values, index=levels[level]['PFAF_ID'].values)
+        prefix = pd.Series(lev12['PFAF_ID'].values // 10 ** (12 - level))
+        hierarchy[level_column(level)] = prefix.map(lookup).values
+    return hierarchy
+
+def assign_levels(gdf, hierarchy, lev12=None):
+    # Add the basin at every level to each feature. Layers without a HYBAS_L12 column, as HydroRIVERS
+    # has, are first joined to the level 12 basins, the only spatial join needed for all 12 levels. A
+    # feature crossing basin edges keeps only its first basin rather than being repeated for each.
+    if lev12 is not None:
+        gdf = gdf.sjoin(
+            lev12[['HYBAS_ID', 'geometry']].rename(columns={'HYBAS_ID': level_column(12)}),
+            how='left'
+        ).drop(columns='index_right')
+        gdf = gdf[~gdf.index.duplicated()]
+    coarser = hierarchy.set_index(level_column(12))
+    return gdf.join(coarser, on=level_column(12))
@@ -0,0 +1,121 @@
+import argparse
+import logging
+import numpy as np
+import shapely
+import met_brewer
+import basins
+import cache
+import compact
+import download
+import jobs
+import lod
+import process
+import reader
+import regions
+
+# Projection for charts of regions drawn in a projected CRS, whose coordinates are already flat
+IDENTITY = {'type': 'identity', 'reflectY': True}
+
+def load_continent(continent, group, cachedir=None):
+    # Read HydroRIVERS once for every region on a continent, over the union of their areas, assigning the
+    # basins at every level as it streams in
+    basinsfile, riversfile = regions.sources(continent)
+    mask = shapely.union_all([region['mask'] for region in group])
+    params = {'mask': mask.wkt}
+    hierarchy = cache.cached_layer(
+        f'hybas_hierarchy_{continent}', [basinsfile], params,
+        lambda: basins.load_hierarchy(basinsfile, mask.bounds, continent),
+        cachedir, geo=False
+    )
+    return cache.cached_layer(
+        f'hydrorivers_{continent}', [riversfile, basinsfile], params,
+        lambda: reader.read_batches(riversfile, lambda batch: basins.assign_levels(batch, hierarchy), mask=mask),
+        cachedir
+    )
+
+def region_layer(rivers, region, strahlerpower, lodpixels):
+    # The region's rivers, found through the spatial index of the continent's rivers, drawn in its CRS
+    gdf = rivers.iloc[rivers.sindex.query(region['mask'], predicate='intersects')]
+    gdf = gdf[~gdf.intersects(region['exclude'])].to_crs(region['crs'])
+    gdf['linewidth'] = gdf['ORD_STRA'].pow(strahlerpower)
+    gdf = process.slim(gdf, 'hydrorivers')
+    return lod.simplify_for_canvas(gdf, *region['size'], lodpixels, region['name'])
+
+def load_continent_basins(continent, group, basinlevels, cachedir=None):
+    # Basins at each level over the bounding box of every region on a continent, in HydroBASINS file order
+    basinsfile = regions.sources(continent)[0]
+    bboxes = np.array([region['bbox'] for region in group])
+    bbox = (*bboxes[:, :2].min(axis=0), *bboxes[:, 2:].max(axis=0))
+    levelbasins = {}
+    for level in basinlevels:
+        levelbasins[level] = cache.cached_layer(
+            f'hybas_{continent}_lev{level:02d}', [basinsfile], {'bbox': bbox},
+            lambda: reader.read_layer(basinsfile, layer=basins.layer_name(level, continent), bbox=bbox, columns=['HYBAS_ID']),
+            cachedir
+        )
+    return levelbasins
+
+def region_basins(levelbasins, region):
+    # Basins at each level in the region's bounding box, kept in file order so the colour cycle matches
+    # process.py's, which reads them with the same bbox
+    area = shapely.box(*region['bbox'])
+    return {
+        level: gdf.iloc[np.sort(gdf.sindex.query(area, predicate='intersects'))][['HYBAS_ID']].reset_index(drop=True)
+        for level, gdf in levelbasins.items()
+    }
+
+def render_job(job):
+    # Render one region in one palette at one basin level, from the layers shared with every worker
+    name, colour, basinlevel, backend, scale = job
+    region, layer, levelbasins = jobs.shared()[name]
+    hexcolours = met_brewer.met_brew(colour)
+    colourmap = process.basin_colours(levelbasins[basinlevel], hexcolours)
+    gdf = compact.unpack(layer, colourmap, hexcolours[0], basinlevel)
+    projection = None if gdf.crs.is_geographic else IDENTITY
+    return process.save_map(
+        [], [gdf], region['size'], process.title_params(*region['title']),
+        f'{name}_rivers-{colour}-{basinlevel}', backend, scale, projection=projection
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create HydroRIVERS river maps of many regions, reading each continental dataset once.')
+    parser.add_argument('regions', help=f'Region names from {regions.REGIONS_DIR}, or region JSON files', nargs='+')
+    parser.add_argument('--colours', help='RMetBrewer colour scheme (colourblind safe)', default='Hokusai2', choices=met_brewer.COLORBLIND_PALETTES_NAMES)
+    parser.add_argument('--allcolours', help='Try all colour themes', default=False, action='store_true')
+    parser.add_argument('--basinlevel', help='Basin levels to use, as levels or ranges such as 5-8', nargs='+', default=[[7]], type=process.basin_levels)
+    parser.add_argument('--strahlerpower', help='Exponential to use when calculating line width from Strahler level', default=5.0, type=float)
+    parser.add_argument('--lod', help='Simplify geometries to this fraction of an output pixel, 0 to keep every vertex', default=0.5, type=float)
+    parser.add_argument('--backend', help='Render maps as Altair HTML or directly to PNG', default='html', choices=['html', 'png'])
+    parser.add_argument('--scale', help='Scale factor for PNG output, for poster sized images', default=1, type=int)
+    parser.add_argument('--cachedir', help='Directory for cached layers', default=cache.CACHE_DIR)
+    parser.add_argument('--nocache', help='Do not read or write cached layers', default=False, action='store_true')
+    parser.add_argument('--downloads', help='Number of source files to download in parallel', default=4, type=int)
+    parser.add_argument('--jobs', help='Number of worker processes, defaults to the number of CPUs', default=None, type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    cachedir = None if args.nocache else args.cachedir
+    basinlevels = sorted(set(level for levels in args.basinlevel for level in levels))
+    colours = met_brewer.COLORBLIND_PALETTES_NAMES if args.allcolours else [args.colours]
+
+    selected = [regions.load(region) for region in args.regions]
+    continents = {}
+    for region in selected:
+        continents.setdefault(region.get('continent', 'eu'), []).append(region)
+    download.download_sources([fname for continent in continents for fname in regions.sources(continent)], jobs=args.downloads)
+
+    # Every region is cut from its continent's rivers, read once, then packed for the workers
+    shared = {}
+    for continent, group in continents.items():
+        rivers = load_continent(continent, group, cachedir)
+        levelbasins = load_continent_basins(continent, group, basinlevels, cachedir)
+        for region in group:
+            gdf = region_layer(rivers, region, args.strahlerpower, args.lod)
+            shared[region['name']] = (region, compact.pack(gdf), region_basins(levelbasins, region))
+        del rivers, levelbasins
+
+    # Every region in every palette at every basin level is an independent job, run concurrently
+    renders = [
+        (name, colour, basinlevel, args.backend, args.scale)
+        for basinlevel in basinlevels for colour in colours for name in shared
+    ]
+    jobs.run(render_job, renders, shared, args.jobs)
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import geopandas as gpd
+import numpy as np
+import shapely
+import altair as alt
+import basins
+import compact
+import lod
+import network
+import process
+import raster
+import reader
+import regions
+
+# Synthetic rivers are generated in the Irish grid, basins in EPSG:4326 over the Ireland bbox, as the
+# real sources are
+RIVER_CRS = 'EPSG:29902'
+RIVER_BOUNDS = (20000, 20000, 360000, 460000)
+# Seconds allowed for python process.py --help, which shouldn't import any of the heavy dependencies
+STARTUP_BUDGET = 0.5
+
+def synthetic_rivers(trees, depth, vertices, seed=0):
+    # Forest of full binary river trees: every node is a reach draining to its parent, so leaves are
+    # Strahler order 1 and the outlet reach is order depth. Returns a GeoDataFrame shaped like HydroRIVERS.
+    rng = np.random.default_rng(seed)
+    nodes = 2 ** depth - 1
+    index = np.arange(nodes)
+    level = np.floor(np.log2(index + 1)).astype(int)
+    parent = (index - 1) // 2
+    minx, miny, maxx, maxy = RIVER_BOUNDS
+    # Each tree covers roughly its share of the area
+    reach = np.sqrt((maxx - minx) * (maxy - miny) / trees) / 3
+    starts = np.zeros((trees, nodes, 2))
+    ends = np.zeros((trees, nodes, 2))
+    angles = np.zeros((trees, nodes))
+    ends[:, 0] = np.column_stack([rng.uniform(minx, maxx, trees), rng.uniform(miny, maxy, trees)])
+    angles[:, 0] = rng.uniform(0, 2 * np.pi, trees)
+    starts[:, 0] = ends[:, 0] + reach * np.column_stack([np.cos(angles[:, 0]), np.sin(angles[:, 0])])
+    for depthlevel in range(1, depth):
+        nodesatlevel = index[level == depthlevel]
+        side = np.where(nodesatlevel % 2 == 1, -1, 1)
+        angles[:, nodesatlevel] = angles[:, parent[nodesatlevel]] + side * 0.5 + rng.normal(0, 0.2, (trees, len(nodesatlevel)))
+        ends[:, nodesatlevel] = starts[:, parent[nodesatlevel]]
+        length = reach * 0.7 ** depthlevel
+        direction = np.stack([np.cos(angles[:, nodesatlevel]), np.sin(angles[:, nodesatlevel])], axis=-1)
+        starts[:, nodesatlevel] = ends[:, nodesatlevel] + length * direction
+    # Interpolate vertices along each reach with a little meander
+    t = np.linspace(0, 1, vertices)[None, None, :, None]
+    coords = starts[:, :, None, :] + (ends - starts)[:, :, None, :] * t
+    coords[:, :, 1:-1, :] += rng.normal(0, reach * 0.01, coords[:, :, 1:-1, :].shape)
+    coords = np.clip(coords, [minx, miny], [maxx, maxy]).reshape(-1, vertices, 2)
+
+    ids = (np.arange(trees)[:, None] * nodes + index[None, :] + 1).ravel()
+    nextdown = np.where(parent >= 0, np.arange(trees)[:, None] * nodes + parent[None, :] + 1, 0).ravel()
+    return gpd.GeoDataFrame({
+        'HYRIV_ID': ids,
+        'NEXT_DOWN': nextdown,
+        'MAIN_RIV': np.repeat(np.arange(trees) * nodes + 1, nodes),
+        'LENGTH_KM': np.linalg.norm(np.diff(coords, axis=1), axis=2).sum(axis=1) / 1000,
+        'ORD_STRA': np.tile(depth - level, trees),
+    }, geometry=shapely.linestrings(coords), crs=RIVER_CRS)
+
+def synthetic_basins(fname, levels=basins.LEVELS, bounds=process.IRELAND_BBOX):
+    # Nested basins in a GeoPackage laid out like HydroBASINS: each level halves the basins of the level
+    # above, alternately across x and y, and PFAF_ID gains a digit 1 or 2 for the half
+    minx, miny, maxx, maxy = bounds
+    for level in levels:
+        xsplits = (level + 1) // 2
+        ysplits = level // 2
+        ix, iy = np.meshgrid(np.arange(2 ** xsplits), np.arange(2 ** ysplits), indexing='ij')
+        ix = ix.ravel()
+        iy = iy.ravel()
+        pfaf = np.zeros(len(ix), dtype=np.int64)
+        for split in range(1, level + 1):
+            if split % 2 == 1:
+                bit = (ix >> (xsplits - (split + 1) // 2)) & 1
+            else:
+                bit = (iy >> (ysplits - split // 2)) & 1
+            pfaf = pfaf * 10 + 1 + bit
+        width = (maxx - minx) / 2 ** xsplits
+        height = (maxy - miny) / 2 ** ysplits
+        gdf = gpd.GeoDataFrame({
+            'HYBAS_ID': level * 10 ** 7 + np.arange(len(ix)),
+            'PFAF_ID': pfaf,
+        }, geometry=shapely.box(minx + ix * width, miny + iy * height, minx + (ix + 1) * width, miny + (iy + 1) * height), crs='EPSG:4326')
+        gdf.to_file(fname, layer=f'hybas_eu_lev{level:02d}_v1c', driver='GPKG')
+    return fname
+
+def stage(report, name, memory, fn):
+    # Time one stage, and if memory is set track its peak Python allocation with tracemalloc
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    entry = report.setdefault(name, {'seconds': []})
+    entry['seconds'].append(seconds)
+    if memory:
+        entry['peak_bytes'] = max(entry.get('peak_bytes', 0), tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    if hasattr(result, '__len__'):
+        entry['rows'] = len(result)
+    return result
+
+def startup(report):
+    # Time a fresh interpreter printing the process.py help
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'process.py')
+    start = time.perf_counter()
+    subprocess.run([sys.executable, script, '--help'], check=True, stdout=subprocess.DEVNULL)
+    report.setdefault('startup', {'seconds': []})['seconds'].append(time.perf_counter() - start)
+
+def run(args, workdir, report):
+    rivers = os.path.join(workdir, 'rivers.gpkg')
+    hybas = os.path.join(workdir, 'hybas.gpkg')
+    if not os.path.isfile(rivers):
+        synthetic_rivers(args.trees, args.depth, args.vertices, args.seed).to_file(rivers, driver='GPKG')
+        synthetic_basins(hybas)
+    hexcolours = ['#000000', '#ff0000', '#00ff00', '#0000ff', '#ffff00', '#00ffff', '#ff00ff']
+
+    gdf = stage(report, 'read', args.memory, lambda: reader.read_layer(rivers))
+    gdf = stage(report, 'reproject', args.memory, lambda: gdf.to_crs('4326'))
+    gdf = stage(report, 'scotland_mask', args.memory, lambda: gdf[~gdf.intersects(regions.exclude(process.IRELAND))])
+    hierarchy = stage(report, 'hierarchy', args.memory, lambda: basins.load_hierarchy(hybas, process.IRELAND_BBOX))
+    lev12 = reader.read_layer(hybas, layer='hybas_eu_lev12_v1c')
+    gdf = stage(report, 'sjoin', args.memory, lambda: basins.assign_levels(gdf, hierarchy, lev12))
+    stage(report, 'network', args.memory, lambda: network.by_outlet(network.prune(gdf, minlength=1), [basins.level_column(args.basinlevel)]))
+    eubas = reader.read_layer(hybas, layer=f'hybas_eu_lev{args.basinlevel:02d}_v1c', geometry=False)
+    colourmap = stage(report, 'colour_map', args.memory, lambda: process.basin_colours(eubas, hexcolours))
+    stage(report, 'colour_assign', args.memory, lambda: process.apply_colours(gdf, colourmap, hexcolours[0], args.basinlevel))
+    linewidth = stage(report, 'width', args.memory, lambda: gdf['ORD_STRA'].pow(args.strahlerpower))
+    gdf['linewidth'] = linewidth
+    gdf = process.slim(gdf, 'hydrorivers')
+    gdf = stage(report, 'simplify', args.memory, lambda: lod.simplify_for_canvas(gdf, *process.HYDRO_SIZE, args.lod, 'synthetic'))
+    packed = stage(report, 'pack', args.memory, lambda: compact.pack(gdf))
+    gdf = stage(report, 'unpack', args.memory, lambda: compact.unpack(packed, colourmap, hexcolours[0], args.basinlevel))
+    spec = stage(report, 'chart_build', args.memory, lambda: json.dumps(process.lines_chart(gdf).properties(width=process.HYDRO_SIZE[0], height=process.HYDRO_SIZE[1]).to_dict()))
+    report['chart_build']['spec_bytes'] = len(spec)
+    title = process.title_params('Synthetic rivers', 'Benchmark')
+    fname = os.path.join(workdir, 'synthetic')
+    stage(report, 'save_html', args.memory, lambda: process.save_map([], [gdf], process.HYDRO_SIZE, title, fname, 'html'))
+    report['save_html']['file_bytes'] = os.path.getsize(f'{fname}.html')
+    stage(report, 'save_png', args.memory, lambda: raster.render([], [gdf], process.HYDRO_SIZE, title, f'{fname}.png'))
+    report['save_png']['file_bytes'] = os.path.getsize(f'{fname}.png')
+
+def compare(report, baseline, tolerance):
+    # Stages more than tolerance slower than the baseline report, comparing the fastest repeat of each
+    regressions = []
+    for name, entry in report['stages'].items():
+        if name in baseline['stages']:
+            before = min(baseline['stages'][name]['seconds'])
+            after = min(entry['seconds'])
+            if after > before * (1 + tolerance) and after - before > 0.01:
+                regressions.append(f'{name}: {before:.3f}s -> {after:.3f}s')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the process.py pipeline on synthetic rivers and basins.')
+    parser.add_argument('--trees', help='Number of synthetic river networks', default=200, type=int)
+    parser.add_argument('--depth', help='Depth of each network, the Strahler order of its outlet', default=8, type=int)
+    parser.add_argument('--vertices', help='Vertices per river reach', default=10, type=int)
+    parser.add_argument('--seed', help='Random seed', default=0, type=int)
+    parser.add_argument('--basinlevel', help='Basin level to colour by', default=7, type=int, choices=basins.LEVELS)
+    parser.add_argument('--strahlerpower', help='Exponential to use when calculating line width from Strahler level', default=5.0, type=float)
+    parser.add_argument('--lod', help='Simplify geometries to this fraction of an output pixel', default=0.5, type=float)
+    parser.add_argument('--repeat', help='Number of times to run each stage', default=3, type=int)
+    parser.add_argument('--memory', help='Track peak memory of each stage with tracemalloc, which slows them down', default=False, action='store_true')
+    parser.add_argument('--output', help='JSON report to write', default='benchmark.json')
+    parser.add_argument('--baseline', help='Previous JSON report to check for regressions against')
+    parser.add_argument('--startupbudget', help='Seconds process.py --help may take before the benchmark fails', default=STARTUP_BUDGET, type=float)
+    parser.add_argument('--tolerance', help='Fraction a stage may slow down by before it counts as a regression', default=0.2, type=float)
+    args = parser.parse_args()
+    alt.data_transformers.disable_max_rows()
+
+    report = {
+        'params': {name: value for name, value in vars(args).items() if name not in ['output', 'baseline', 'tolerance', 'startupbudget']},
+        'python': sys.version,
+        'platform': platform.platform(),
+        'stages': {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for i in range(args.repeat):
+            startup(report['stages'])
+            run(args, workdir, report['stages'])
+    report['features'] = args.trees * (2 ** args.depth - 1)
+    report['maxrss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    for name, entry in report['stages'].items():
+        print(f'{name:15} {min(entry["seconds"]):8.3f}s' + (f' {entry["peak_bytes"] / 2 ** 20:8.1f}MB' if 'peak_bytes' in entry else ''))
+
+    failures = []
+    if min(report['stages']['startup']['seconds']) > args.startupbudget:
+        failures.append(f'process.py --help took {min(report["stages"]["startup"]["seconds"]):.3f}s, over the {args.startupbudget}s budget')
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += [f'Regression in {regression}' for regression in compare(report, json.load(f), args.tolerance)]
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
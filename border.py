@@ -0,0 +1,47 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import box
+import cache
+import reader
+
+ROI_OUTLINE = 'ROI_landmask.zip'
+NI_BOUNDARY = 'NI_land_area.zip'
+# Irish grid, so that buffer distances are in metres
+METRIC_CRS = 'EPSG:29902'
+# How far the NI boundary is extended to find the shared part of the ROI boundary, about the 0.015 degrees
+# previously used in EPSG:4326
+NI_EXTEND = 1250
+# Limits of the border, to remove the points where the coastlines get too close
+BORDER_BBOX = (-8.415527, 53.998083, -5.605774, 55.152197)
+
+def border_line(cachedir=None):
+    # The ROI boundary within the extended NI boundary, computed once in the metric CRS and cached
+    def loader():
+        roioutline = reader.read_layer(ROI_OUTLINE).to_crs(METRIC_CRS)
+        niboundary = reader.read_layer(NI_BOUNDARY).to_crs(METRIC_CRS)
+        niboundary['geometry'] = niboundary.buffer(NI_EXTEND)
+        limits = gpd.GeoSeries([box(*BORDER_BBOX)], crs='EPSG:4326').to_crs(METRIC_CRS)
+        border = gpd.clip(roioutline.boundary.clip(niboundary), mask=limits)
+        return gpd.GeoDataFrame(geometry=border.values, crs=METRIC_CRS)
+    return cache.cached_layer(
+        'border_line', [ROI_OUTLINE, NI_BOUNDARY], {'extend': NI_EXTEND, 'bbox': BORDER_BBOX, 'crs': METRIC_CRS},
+        loader, cachedir
+    )
+
+def border_zone(distance=5000, crs='EPSG:4326', cachedir=None):
+    # Single polygon covering everything within distance metres of the border, in crs
+    line = border_line(cachedir)
+    zone = gpd.GeoSeries([shapely.union_all(line.buffer(distance).values)], crs=METRIC_CRS)
+    return zone.to_crs(crs).values[0]
+
+def clip(gdf, zone):
+    # Clip to the zone, using the spatial index to find candidates and only cutting the geometries that
+    # cross its edge. Anything wholly inside is kept as it is.
+    candidates = gdf.iloc[gdf.sindex.query(zone, predicate='intersects')].copy()
+    shapely.prepare(zone)
+    geometries = np.array(candidates.geometry.values)
+    inside = shapely.contains(zone, geometries)
+    geometries[~inside] = shapely.intersection(geometries[~inside], zone)
+    candidates.geometry = gpd.GeoSeries(geometries, index=candidates.index, crs=candidates.crs)
+    return candidates[~candidates.geometry.is_empty]
@@ -0,0 +1,61 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import cache
+
+# Record of the inputs each output was last built from, so that unchanged outputs can be skipped
+MANIFEST = '.build.json'
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_code_version = None
+
+def code_version():
+    # Hash of every module of the pipeline, so any code change rebuilds everything
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        for fname in sorted(glob.glob(os.path.join(CODE_DIR, '*.py'))):
+            digest.update(os.path.basename(fname).encode())
+            digest.update(cache.file_hash(fname).encode())
+        _code_version = digest.hexdigest()[:16]
+    return _code_version
+
+def target_key(sources, params):
+    # Key of an output built from the source files with the params, by the current code
+    key = {
+        'sources': {source: cache.file_hash(source) for source in sorted(sources)},
+        'params': params,
+        'code': code_version(),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def load(fname=MANIFEST):
+    if not os.path.isfile(fname):
+        return {}
+    with open(fname) as f:
+        return json.load(f)
+
+def save(manifest, fname=MANIFEST):
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(fname + '.tmp', fname)
+
+def stale(manifest, outputs, key):
+    # True if the first output was built from different inputs, or any of the outputs is missing. The
+    # rest of the outputs are files shared between targets, such as data files, so aren't keyed.
+    return manifest.get(outputs[0]) != key or not all(os.path.exists(output) for output in outputs)
+
+def mark(manifest, outputs, key):
+    manifest[outputs[0]] = key
+
+def select(manifest, targets, force=False):
+    # The targets, (job, outputs, key) tuples, that need building, logging the ones that are up to date
+    selected = []
+    for job, outputs, key in targets:
+        if force or stale(manifest, outputs, key):
+            selected.append((job, outputs, key))
+        else:
+            logging.info(f'{outputs[0]} is up to date')
+    return selected
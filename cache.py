@@ -0,0 +1,85 @@
+import hashlib
+import json
+import logging
+import os
+import lazy
+import profiling
+
+gpd = lazy.module('geopandas')
+pd = lazy.module('pandas')
+
+CACHE_DIR = '.cache'
+CACHE_SIZE = 2048 * 1024 * 1024
+# Modules with the code that builds cached layers, so that changing how a layer is loaded invalidates it
+LOADER_MODULES = ['basins.py', 'batch.py', 'border.py', 'process.py', 'reader.py', 'regions.py']
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_hashes = {}
+
+def file_hash(fname):
+    # Hash the file contents, remembering the result for as long as the file is unchanged
+    stat = os.stat(fname)
+    memo = (os.path.abspath(fname), stat.st_size, stat.st_mtime_ns)
+    if memo not in _hashes:
+        digest = hashlib.sha256()
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        _hashes[memo] = digest.hexdigest()
+    return _hashes[memo]
+
+def loader_version():
+    return [file_hash(os.path.join(CODE_DIR, module)) for module in LOADER_MODULES]
+
+def cache_key(name, sources, params):
+    key = {
+        'name': name,
+        'sources': [file_hash(source) for source in sources],
+        'params': params,
+        'code': loader_version(),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def evict(cachedir=CACHE_DIR, maxsize=CACHE_SIZE):
+    # Remove least recently used entries until the cache fits within maxsize bytes
+    entries = []
+    if cachedir is None or not os.path.isdir(cachedir):
+        return
+    for fname in os.listdir(cachedir):
+        if fname.endswith('.parquet'):
+            stat = os.stat(os.path.join(cachedir, fname))
+            entries.append((stat.st_atime, stat.st_size, fname))
+    total = sum(entry[1] for entry in entries)
+    for atime, size, fname in sorted(entries):
+        if total <= maxsize:
+            break
+        logging.info(f'Evicting {fname} from cache')
+        os.remove(os.path.join(cachedir, fname))
+        total -= size
+
+def cached_layer(name, sources, params, loader, cachedir=CACHE_DIR, geo=True):
+    # Return the GeoDataFrame built by loader, from cachedir if the sources and params are unchanged.
+    # A cachedir of None disables the cache. With geo=False the loader returns a plain DataFrame.
+    if cachedir is None:
+        with profiling.stage('load', layer=name, cached=False):
+            gdf = loader()
+            profiling.record_layer(gdf)
+        return gdf
+    fname = os.path.join(cachedir, f'{name}-{cache_key(name, sources, params)}.parquet')
+    if os.path.isfile(fname):
+        logging.info(f'Reading {name} from {fname}')
+        # Mark the entry as recently used for eviction
+        os.utime(fname)
+        with profiling.stage('load', layer=name, cached=True):
+            gdf = gpd.read_parquet(fname) if geo else pd.read_parquet(fname)
+            profiling.record_layer(gdf)
+        return gdf
+    with profiling.stage('load', layer=name, cached=False):
+        gdf = loader()
+        profiling.record_layer(gdf)
+    with profiling.stage('cache_write', layer=name):
+        os.makedirs(cachedir, exist_ok=True)
+        gdf.to_parquet(fname + '.tmp')
+        os.replace(fname + '.tmp', fname)
+        profiling.record_file(fname)
+    return gdf
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import basins
+
+# Quantization step in CRS units, about a metre in EPSG:4326, and a metre in projected CRSs
+RESOLUTION = 1e-5
+PROJECTED_RESOLUTION = 1.0
+# Shapely geometry type ids of line and polygon layers
+LINE_TYPES = [1, 5]
+AREA_TYPES = [3, 6]
+
+def homogenise(geometries):
+    # Reduce each geometry to the parts of the layer's main family, lines or polygons, so the layer can
+    # be stored as one ragged array. Clipping can leave points and collections behind. Returns the
+    # geometries and the rows they came from.
+    types = shapely.get_type_id(geometries)
+    family = AREA_TYPES if np.isin(types, AREA_TYPES).any() else LINE_TYPES
+    if np.isin(types, family).all():
+        return geometries, np.arange(len(geometries))
+    parts, index = shapely.get_parts(geometries, return_index=True)
+    keep = np.isin(shapely.get_type_id(parts), family[:1])
+    rows, index = np.unique(index[keep], return_inverse=True)
+    combine = shapely.multipolygons if family == AREA_TYPES else shapely.multilinestrings
+    return combine(parts[keep], indices=index), rows
+
+def pack_geometries(geometries, crs=None, resolution=None):
+    # Delta-encoded 2D integer coordinates of the geometries in a ragged array, and the rows of the
+    # geometries that were kept
+    if resolution is None:
+        resolution = PROJECTED_RESOLUTION if crs is not None and crs.is_projected else RESOLUTION
+    geometries, rows = homogenise(geometries)
+    if len(geometries):
+        geometry_type, coords, offsets = shapely.to_ragged_array(geometries, include_z=False)
+    else:
+        # Shapely can't tell the type of an empty layer, which is left with no geometry type at all
+        geometry_type, coords, offsets = None, np.zeros((0, 2)), ()
+    origin = coords.min(axis=0) if len(coords) else np.zeros(2)
+    quantized = np.rint((coords - origin) / resolution).astype(np.int64)
+    deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).astype(np.int32)
+    return {
+        'type': geometry_type,
+        'offsets': offsets,
+        'origin': origin,
+        'resolution': resolution,
+        'deltas': deltas,
+        'crs': crs,
+    }, rows
+
+def pack(gdf, resolution=None):
+    # Compact copy of a layer: its packed geometries, basin IDs per level as category codes, and float32
+    # line widths. Every other attribute is dropped.
+    layer, rows = pack_geometries(np.asarray(gdf.geometry.values), gdf.crs, resolution)
+    codes = []
+    categories = []
+    for level in basins.LEVELS:
+        levelcodes, levelcategories = pd.factorize(gdf[basins.level_column(level)].values[rows])
+        codes.append(levelcodes.astype(np.int32))
+        categories.append(np.asarray(levelcategories))
+    return {
+        **layer,
+        'basincodes': np.column_stack(codes) if len(rows) else np.zeros((0, len(codes)), dtype=np.int32),
+        'basins': categories,
+        'linewidth': gdf['linewidth'].values[rows].astype(np.float32) if 'linewidth' in gdf else None,
+    }
+
+def geometries(layer, rows=None):
+    # Decode the packed geometries, or only those at rows. Rows are picked out of each level of offsets in
+    # turn, from the geometries down to the coordinates, and only the coordinates up to the last one used
+    # are decoded.
+    if layer['type'] is None or (rows is not None and len(rows) == 0):
+        return np.array([], dtype=object)
+    offsets = layer['offsets']
+    if rows is not None:
+        offsets = []
+        index = np.asarray(rows, dtype=np.int64)
+        for level in reversed(layer['offsets']):
+            starts = level[index]
+            counts = level[index + 1] - starts
+            ends = np.cumsum(counts)
+            offsets.insert(0, np.r_[0, ends])
+            index = np.repeat(starts - (ends - counts), counts) + np.arange(ends[-1])
+    deltas = layer['deltas'] if rows is None else layer['deltas'][:index.max() + 1 if len(index) else 0]
+    coords = np.cumsum(deltas, axis=0, dtype=np.int64) * layer['resolution'] + layer['origin']
+    return shapely.from_ragged_array(layer['type'], coords if rows is None else coords[index], tuple(offsets))
+
+def unpack(layer, colourmap, default, basinlevel):
+    # GeoDataFrame with only what the renderers use: geometry, hexcolour for the basin level and linewidth.
+    # Colours are looked up once per basin, then spread to the features by their category codes.
+    basincolours = pd.Series(layer['basins'][basinlevel - 1]).map(colourmap).fillna(default).to_numpy(object)
+    # Features outside every basin have code -1, which picks out the default appended at the end
+    hexcolour = np.append(basincolours, default)[layer['basincodes'][:, basinlevel - 1]]
+    gdf = gpd.GeoDataFrame({'hexcolour': hexcolour}, geometry=geometries(layer), crs=layer['crs'])
+    if layer['linewidth'] is not None:
+        gdf['linewidth'] = layer['linewidth']
+    return gdf
@@ -0,0 +1,131 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import os.path
+import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Manifest of source files: url, and optionally the expected size in bytes and sha256
+MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sources.json')
+CHUNK_SIZE = 1024 * 1024
+
+# Source files needed by each of the process.py maps
+MAP_SOURCES = {
+    'Hydro': ['hybas_eu_lev01-12_v1c.zip', 'HydroRIVERS_v10_eu.gdb.zip'],
+    'NI': ['hybas_eu_lev01-12_v1c.zip', 'ni-rivers-strahler-ranking.zip', 'ni-lake-water-bodies.geojson'],
+    'ROI': ['hybas_eu_lev01-12_v1c.zip', 'roi-river-netroutes.json', 'Lakes_&_Reservoirs_-_OSi_National_250k_Map_Of_Ireland.geojson'],
+    'Border': ['hybas_eu_lev01-12_v1c.zip', 'ROI_landmask.zip', 'NI_land_area.zip'],
+}
+
+def load_manifest(fname=MANIFEST):
+    with open(fname) as f:
+        return json.load(f)
+
+def make_session(poolsize=8):
+    # One session shared by every download so connections are pooled between requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=poolsize, pool_maxsize=poolsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def sha256(fname):
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def verify(fname, entry):
+    if 'size' in entry and os.path.getsize(fname) != entry['size']:
+        raise ValueError(f'{fname} is {os.path.getsize(fname)} bytes, expected {entry["size"]}')
+    if 'sha256' in entry and sha256(fname) != entry['sha256']:
+        raise ValueError(f'{fname} has sha256 {sha256(fname)}, expected {entry["sha256"]}')
+
+def pin(manifest=None, fname=MANIFEST):
+    # Record the size and sha256 of every source that has been downloaded in the manifest, so that later
+    # downloads are verified against them
+    if manifest is None:
+        manifest = load_manifest(fname)
+    for source, entry in manifest.items():
+        if os.path.isfile(source):
+            entry['size'] = os.path.getsize(source)
+            entry['sha256'] = sha256(source)
+    with open(fname, 'w') as f:
+        json.dump(manifest, f, indent=4)
+        f.write('\n')
+    return manifest
+
+def download(session, url, fname, entry=None):
+    # Download url to fname via a partial file, resuming a previous partial download if there is one.
+    # fname only appears once the download is complete and verified.
+    if entry is None:
+        entry = {}
+    if os.path.isfile(fname) and ('size' not in entry or os.path.getsize(fname) == entry['size']):
+        return fname
+    partial = fname + '.part'
+    offset = os.path.getsize(partial) if os.path.isfile(partial) else 0
+    # Ask for the bytes as stored, so that Content-Length and Range offsets count the same bytes that are
+    # written, rather than a gzipped body that requests decodes
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+    with session.get(url, stream=True, headers=headers) as stream:
+        if stream.status_code == 416:
+            # The partial file already holds the whole resource
+            expected = offset
+        else:
+            stream.raise_for_status()
+            if stream.status_code != 206:
+                # Server ignored the range request, start again from the beginning
+                offset = 0
+            length = stream.headers.get('Content-Length')
+            expected = offset + int(length) if length is not None else None
+            logging.info(f'Downloading {fname} from byte {offset}')
+            with open(partial, 'ab' if offset else 'wb') as f:
+                for chunk in stream.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+    if expected is not None and os.path.getsize(partial) != expected:
+        raise IOError(f'Incomplete download of {fname}, {os.path.getsize(partial)} of {expected} bytes')
+    try:
+        verify(partial, entry)
+    except ValueError:
+        os.remove(partial)
+        raise
+    os.replace(partial, fname)
+    return fname
+
+def download_sources(fnames, manifest=None, jobs=4):
+    # Download the named sources from the manifest in parallel, skipping any already present. requests
+    # doesn't promise that a Session is thread safe, so each download thread has its own.
+    if manifest is None:
+        manifest = load_manifest()
+    local = threading.local()
+    def fetch(fname):
+        if not hasattr(local, 'session'):
+            local.session = make_session(1)
+        return download(local.session, manifest[fname]['url'], fname, manifest[fname])
+    fnames = list(dict.fromkeys(fnames))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(fetch, fnames))
+
+def download_maps(maps, manifest=None, jobs=4):
+    return download_sources([fname for m in maps for fname in MAP_SOURCES.get(m, [])], manifest, jobs)
+
+def download_file_if_not_exists(url, fname=None):
+    if fname is None:
+        fname = os.path.basename(url)
+    return download(make_session(1), url, fname)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download every source in the manifest.')
+    parser.add_argument('--downloads', help='Number of source files to download in parallel', default=4, type=int)
+    parser.add_argument('--pin', help='Record the size and sha256 of the downloaded sources in the manifest', default=False, action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    download_sources(list(load_manifest()), jobs=args.downloads)
+    if args.pin:
+        pin()
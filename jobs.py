@@ -0,0 +1,68 @@
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import mapped
+import profiling
+
+# Shared memory filesystem for the arrays workers memory-map, where there is one with room for them.
+# Containers often have a small one, 64MB by default in Docker, so otherwise they go in a temporary
+# directory on disk, which the workers' maps still share through the page cache.
+SHM_DIR = '/dev/shm'
+SHM_HEADROOM = 1.25
+
+# Read-only data shared by every job, set once per worker process by _init_worker
+_shared = None
+
+def _init_worker(shared, settings=None):
+    global _shared
+    _shared = mapped.attach(shared)
+    if settings is not None:
+        profiling.configure(**settings)
+
+def _traced(fn, job):
+    # Run one job in a worker, handing back the profiling events it recorded with its result
+    with profiling.stage('job', job=str(job)):
+        result = fn(job)
+    return result, profiling.drain()
+
+def shared():
+    return _shared
+
+def _mapdir(size):
+    if os.path.isdir(SHM_DIR):
+        stat = os.statvfs(SHM_DIR)
+        if stat.f_bavail * stat.f_frsize >= size * SHM_HEADROOM:
+            return SHM_DIR
+    return None
+
+def run(fn, jobs, shared=None, workers=None):
+    # Run fn(job) for every job on a pool of worker processes, sending shared to each worker once rather
+    # than with every job, and logging progress as jobs finish. The numpy arrays in shared, such as packed
+    # layers, are memory-mapped by every worker, and aren't usable by the caller afterwards. A single
+    # worker runs the jobs in process.
+    jobs = list(jobs)
+    results = {}
+    start = time.perf_counter()
+    def progress(done, job, result):
+        logging.info(f'[{done}/{len(jobs)}] {job} -> {result} ({time.perf_counter() - start:.1f}s)')
+    if workers == 1:
+        _init_worker(shared)
+        for done, job in enumerate(jobs, 1):
+            with profiling.stage('job', job=str(job)):
+                results[job] = fn(job)
+            progress(done, job, results[job])
+        return results
+    # Large arrays in shared move to files, which workers map rather than unpickle. The arrays are taken
+    # out of shared's dicts and lists, so the caller's data only refers to the files during the run.
+    with tempfile.TemporaryDirectory(prefix='jobs-', dir=_mapdir(mapped.nbytes(shared))) as mapdir:
+        shared = mapped.store(shared, mapdir)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared, profiling.settings())) as executor:
+            futures = {executor.submit(_traced, fn, job): job for job in jobs}
+            for done, future in enumerate(as_completed(futures), 1):
+                job = futures[future]
+                results[job], events = future.result()
+                profiling.extend(events)
+                progress(done, job, results[job])
+    return results
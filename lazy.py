@@ -0,0 +1,17 @@
+import importlib.util
+import sys
+
+def module(name):
+    # Module that is only imported when one of its attributes is first used, so that commands such as
+    # --help, and stages or backends that aren't selected, don't pay for importing heavy dependencies
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    lazymodule = importlib.util.module_from_spec(spec)
+    sys.modules[name] = lazymodule
+    loader.exec_module(lazymodule)
+    return lazymodule
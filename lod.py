@@ -0,0 +1,29 @@
+import logging
+import shapely
+import topojson as tp
+import profiling
+
+def tolerance(bounds, width, height, pixels=0.5):
+    # Size in CRS units of a fraction of a pixel, when bounds are drawn on a width x height canvas
+    minx, miny, maxx, maxy = bounds
+    return pixels * max((maxx - minx) / width, (maxy - miny) / height)
+
+def vertex_count(gdf):
+    return int(shapely.get_num_coordinates(gdf.geometry.values).sum())
+
+def simplify(gdf, tolerance, name='layer'):
+    # Topology preserving simplification, so that shared river junctions and lake shores stay joined up
+    if len(gdf) == 0 or tolerance <= 0:
+        return gdf
+    with profiling.stage('simplify', layer=name):
+        before = vertex_count(gdf)
+        topo = tp.Topology(gdf, prequantize=False, toposimplify=tolerance)
+        simplified = topo.to_gdf()
+        simplified = simplified[~simplified.geometry.is_empty].set_crs(gdf.crs, allow_override=True)
+        after = vertex_count(simplified)
+        profiling.record(features=len(simplified), vertices_before=before, vertices=after)
+    logging.info(f'Simplified {name} from {before} to {after} vertices (tolerance {tolerance:.6f})')
+    return simplified
+
+def simplify_for_canvas(gdf, width, height, pixels=0.5, name='layer'):
+    return simplify(gdf, tolerance(gdf.total_bounds, width, height, pixels), name)
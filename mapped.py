@@ -0,0 +1,55 @@
+import itertools
+import os
+import lazy
+
+np = lazy.module('numpy')
+
+# Arrays smaller than this are sent to workers as they are, rather than through a file
+MIN_BYTES = 64 * 1024
+
+class Mapped:
+    # Reference to an array saved by store, which attach loads memory-mapped
+    def __init__(self, fname):
+        self.fname = fname
+
+def _mappable(data):
+    return isinstance(data, np.ndarray) and data.dtype != object and data.nbytes >= MIN_BYTES
+
+def nbytes(data):
+    # Total size of the arrays in data that store would write out
+    if type(data) is dict:
+        return sum(nbytes(value) for value in data.values())
+    if type(data) in (list, tuple):
+        return sum(nbytes(value) for value in data)
+    return data.nbytes if _mappable(data) else 0
+
+def store(data, dirname, counter=None):
+    # Save every large numeric array in data, nested dicts, lists and tuples, as a .npy file in dirname
+    # and replace it with a reference to the file. Dicts and lists are updated in place, so the arrays
+    # move out of the caller's data rather than being held twice. Everything else is left as it is.
+    counter = counter or itertools.count()
+    if type(data) is dict:
+        for key, value in data.items():
+            data[key] = store(value, dirname, counter)
+        return data
+    if type(data) is list:
+        data[:] = [store(value, dirname, counter) for value in data]
+        return data
+    if type(data) is tuple:
+        return tuple(store(value, dirname, counter) for value in data)
+    if _mappable(data):
+        fname = os.path.join(dirname, f'{next(counter)}.npy')
+        np.save(fname, data)
+        return Mapped(fname)
+    return data
+
+def attach(data):
+    # Data from store with each reference replaced by a read-only memory map of its file, so every
+    # process shares the same pages rather than holding its own copy
+    if type(data) is dict:
+        return {key: attach(value) for key, value in data.items()}
+    if type(data) in (list, tuple):
+        return type(data)(attach(value) for value in data)
+    if isinstance(data, Mapped):
+        return np.load(data.fname, mmap_mode='r')
+    return data
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+# River networks as arrays: downstream[i] is the position of the reach that reach i drains into, or -1 at
+# an outlet, including reaches whose next reach was cut off by the area read. Upstream adjacency is the
+# same tree in compressed sparse row form. Every traversal works a whole level or frontier at a time.
+
+def build(ids, nextdown):
+    # Downstream positions from reach IDs and the ID of the next reach down, 0 at outlets in HydroRIVERS
+    return pd.Index(ids).get_indexer(nextdown).astype(np.int64)
+
+def upstream_csr(downstream):
+    # Reaches draining directly into reach i are children[offsets[i]:offsets[i + 1]]
+    valid = np.flatnonzero(downstream >= 0)
+    children = valid[np.argsort(downstream[valid], kind='stable')]
+    offsets = np.zeros(len(downstream) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(downstream[valid], minlength=len(downstream)), out=offsets[1:])
+    return offsets, children
+
+def _jump(downstream):
+    # Pointer jumping: each pass follows the pointers of the pointers, so reaching the outlets takes
+    # log2 of the longest path passes. Returns the outlet and the number of reaches to it for each reach.
+    index = np.arange(len(downstream))
+    parent = np.where(downstream >= 0, downstream, index)
+    depth = (downstream >= 0).astype(np.int64)
+    while len(parent) and (parent[parent] != parent).any():
+        depth = depth + depth[parent]
+        parent = parent[parent]
+    return parent, depth
+
+def outlets(downstream):
+    return _jump(downstream)[0]
+
+def depths(downstream):
+    return _jump(downstream)[1]
+
+def accumulate(downstream, values):
+    # Total of values over each reach and everything upstream of it, adding each level of the tree into
+    # the level below, starting furthest from the outlets
+    total = np.asarray(values, dtype=np.float64).copy()
+    depth = depths(downstream)
+    order = np.argsort(-depth, kind='stable')
+    levels = np.split(order, np.flatnonzero(np.diff(depth[order])) + 1)
+    for nodes in levels:
+        nodes = nodes[downstream[nodes] >= 0]
+        np.add.at(total, downstream[nodes], total[nodes])
+    return total
+
+def upstream(downstream, positions):
+    # Mask of the reaches at positions and everything draining into them, expanding the whole frontier
+    # each pass
+    offsets, children = upstream_csr(downstream)
+    mask = np.zeros(len(downstream), dtype=bool)
+    frontier = np.unique(np.asarray(positions, dtype=np.int64))
+    mask[frontier] = True
+    while len(frontier):
+        counts = offsets[frontier + 1] - offsets[frontier]
+        starts = np.repeat(offsets[frontier] - (np.cumsum(counts) - counts), counts)
+        frontier = children[starts + np.arange(counts.sum())]
+        frontier = frontier[~mask[frontier]]
+        mask[frontier] = True
+    return mask
+
+def reaches(gdf):
+    return build(gdf['HYRIV_ID'].values, gdf['NEXT_DOWN'].values)
+
+def by_outlet(gdf, columns):
+    # Give every reach the values of columns at its river's outlet, so a whole river system is coloured
+    # by the basin it drains out of, however many basins its reaches cross
+    root = outlets(reaches(gdf))
+    gdf = gdf.copy()
+    for column in columns:
+        gdf[column] = gdf[column].values[root]
+    return gdf
+
+def catchment(gdf, ids):
+    # Reaches upstream of, and including, the reaches with HYRIV_ID in ids
+    positions = pd.Index(gdf['HYRIV_ID'].values).get_indexer(ids)
+    return gdf[upstream(reaches(gdf), positions[positions >= 0])]
+
+def prune(gdf, minlength=0, minorder=0, order='ORD_STRA'):
+    # Drop reaches with less than minlength km of river upstream of their downstream end, or below
+    # minorder. Both only grow downstream, so what's left stays connected to the outlets.
+    keep = gdf[order].values >= minorder
+    if minlength > 0:
+        keep &= accumulate(reaches(gdf), gdf['LENGTH_KM'].values) >= minlength
+    return gdf[keep]
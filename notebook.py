@@ -3,38 +3,16 @@ from genericpath import isfile
 import pydeck as pdk
 import geopandas as gpd
 from shapely.geometry import Polygon
-import numpy as np
 import topojson as tp
 import met_brewer
-import requests
 import os.path
-
-def extract_coord_lists(x):
-    if x.type == 'MultiLineString':
-#        return list([(y[0],y[1]) for y in x[0].coords])
-        if len(x.geoms) == 1:
-            return list([(y[0],y[1]) for y in x.geoms[0].coords])
-        else:
-            return [list([(y[0],y[1]) for y in line.coords]) for line in x.geoms]
-    elif x.type == 'LineString':
-        return list([(y[0],y[1]) for y in x.coords])
-    else:
-        raise Exception('Unknown type {x.type}')
+from download import download_file_if_not_exists
+from paths import path_layer
 
 # Colour schemes from RMetBrewer
 scheme = 'Derain'
-colours = [(int(c[1:3], 16), int(c[3:5], 16), int(c[5:], 16)) for c in met_brewer.met_brew(scheme)]
-
-def download_file_if_not_exists(url, fname=None):
-    if fname is None:
-        fname = os.path.basename(url)
-    if not os.path.isfile(fname):
-        session = requests.Session()
-        with session.get(url, stream=True) as stream:
-            stream.raise_for_status()
-            with open(fname, 'wb') as f:
-                for chunk in stream.iter_content(chunk_size=8192): 
-                    f.write(chunk)
+hexcolours = met_brewer.met_brew(scheme)
+
 # TODO:
 # 1. [x] export image from pydeck, make sure that it is high quality and zoom works well, if not move to matplotlib (and check if altair is suitable)
 # 2. [x] choose colours and basin level for all-Ireland basins map (from HydroRivers and more detail from NI/IE), NI basins map and IE basins map
@@ -42,31 +20,28 @@ def download_file_if_not_exists(url, fname=None):
 # 4. [x] create a dataset which is rivers crossing the land border (spatial join all rivers within 10k of border, or better those crossing the border limited to only points within 10k of border)
 # 5. [x] choose colours and export the border crossing dataset, add titles/subtitles
 # 6. [x] write up text for tweet and linkedin and publish
-# 7. [ ] Cheshire version using the HydroRivers data (or maybe England data if any available)
+# 7. [x] Cheshire version using the HydroRivers data (or maybe England data if any available), see `python batch.py cheshire`
 #
 # Altair [example](https://altair-viz.github.io/gallery/london_tube.html)
 # %%
 gdf = gpd.read_file('https://opendata-daerani.hub.arcgis.com/datasets/DAERANI::rivers-strahler-ranking.zip?outSR=%7B%22latestWkid%22%3A29902%2C%22wkid%22%3A29900%7D')
 gdf.geometry = gdf.geometry.to_crs('4326')
-gdf['plotstrings'] = gdf.geometry.apply(extract_coord_lists)
 basins = gpd.read_file('https://opendata-daerani.hub.arcgis.com/datasets/DAERANI::river-basin-districts.zip?outSR=%7B%22latestWkid%22%3A29902%2C%22wkid%22%3A29900%7D')
 basins.geometry = basins.geometry.to_crs('4326')
-basins["colour"] = colours[1:4]
+basins["hexcolour"] = hexcolours[1:4]
 gdf = gdf.sjoin(basins, how='left')
-gdf["colour"] = gdf["colour"].apply(lambda x: colours[0] if x is np.nan else x)
 
 # %%
 view_state = pdk.ViewState(latitude=53.45, longitude=-6.49, zoom=5.7)
 
-layer = pdk.Layer(
-    type="PathLayer",
-    data=gdf,
+# Rivers not in any basin get the first colour
+layer = path_layer(
+    gdf,
+    width="strahler",
+    default=hexcolours[0],
     pickable=True,
-    get_color="colour",
     width_scale=200,
     width_min_pixels=1,
-    get_path="plotstrings",
-    get_width="strahler",
     tooltip=False
 )
 
@@ -80,22 +55,17 @@ r
 # %%
 ie = gpd.read_file('http://gis.epa.ie/geoserver/EPA/ows?service=WFS&version=1.0.0&request=GetFeature&typeName=EPA:WATER_RIVNETROUTES&outputFormat=application%2Fjson&srsName=EPSG:4326')
 ie.geometry = ie.geometry.to_crs('4326')
-ie['plotstrings'] = ie.geometry.apply(extract_coord_lists)
-ie["colour"] = ""
-ie["colour"] = ie["colour"].apply(lambda x: colours[0] if x == ""  else x)
+ie["hexcolour"] = hexcolours[0]
 
 # %%
 view_state = pdk.ViewState(latitude=54.78, longitude=-6.49, zoom=7)
 
-layer = pdk.Layer(
-    type="PathLayer",
-    data=ie,
+layer = path_layer(
+    ie,
+    width="ORDER_",
     pickable=True,
-    get_color="colour",
     width_scale=200,
     width_min_pixels=1,
-    get_path="plotstrings",
-    get_width="ORDER_",
     tooltip=False
 )
 
@@ -130,17 +100,14 @@ eu = eu[~eu.intersects(Polygon([
     (-5.34, 55.23)
     ]
 ))]
-eu['plotstrings'] = eu.geometry.apply(extract_coord_lists) # Convert to pydeck friendly format
 download_file_if_not_exists('https://data.hydrosheds.org/file/hydrobasins/standard/hybas_eu_lev01-12_v1c.zip')
 # Get Hydrobasins data for Ireland and apply colours
 eubas = gpd.read_file('hybas_eu_lev01-12_v1c.zip', layer='hybas_eu_lev06_v1c', bbox=(-10.56,51.39,-5.34,55.43))
-eubas["colour"] = colours[1:] + colours[1:6]
-eubas["hexcolour"] = met_brewer.met_brew(scheme)[1:] + met_brewer.met_brew(scheme)[1:6]
+eubas["hexcolour"] = hexcolours[1:] + hexcolours[1:6]
 # Spatial join of rivers to basins
 eugdf = eu.sjoin(eubas, how='left')
 # Add colour for any rivers not in basins
-eugdf["colour"] = eugdf["colour"].apply(lambda x: colours[0] if x is np.nan else x)
-eubas["hexcolour"] = eugdf["hexcolour"].apply(lambda x: met_brewer.met_brew(scheme)[0] if x is np.nan else x)
+eugdf["hexcolour"] = eugdf["hexcolour"].fillna(hexcolours[0])
 
 
 # %%
@@ -214,15 +181,12 @@ driver = get_chrome_driver()
 # %%
 view_state = pdk.ViewState(latitude=53.45, longitude=-6.49, zoom=5.7)
 
-layer = pdk.Layer(
-    type="PathLayer",
-    data=eugdf,
+layer = path_layer(
+    eugdf,
+    width="ORD_STRA",
     pickable=True,
-    get_color="colour",
     width_scale=200,
     width_min_pixels=1,
-    get_path="plotstrings",
-    get_width="ORD_STRA",
     tooltip=False
 )
 
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+def path_buffers(geometries):
+    # Flatten (multi)linestrings to one path per part: a float array of every vertex, the start offset
+    # of each path into it, and the row each path came from
+    parts, index = shapely.get_parts(np.asarray(geometries), return_index=True)
+    coords = shapely.get_coordinates(parts)
+    counts = shapely.get_num_coordinates(parts)
+    starts = (np.cumsum(counts) - counts).astype(np.int32)
+    return coords, starts, index
+
+def split_paths(coords, starts):
+    return np.split(coords, starts[1:])
+
+def rgb_colours(hexcolours, default=None):
+    # Convert a column of '#rrggbb' strings to an n x 3 uint8 array, parsing each distinct colour once
+    hexcolours = pd.Series(hexcolours)
+    if default is not None:
+        hexcolours = hexcolours.fillna(default)
+    codes, uniques = pd.factorize(hexcolours)
+    rgb = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in uniques], dtype=np.uint8).reshape(-1, 3)
+    return rgb[codes]
+
+def path_data(gdf, colour='hexcolour', width='linewidth', default='#000000', decimals=5):
+    # PathLayer data with a row per path, splitting multi-part lines into a path per part: its vertices,
+    # RGB colour and width. pydeck sends data as JSON, which writes numpy cells as their str(), and its
+    # binary transport can't carry variable length paths, so the cells are lists. They are converted
+    # from the flat arrays in one pass, with coordinates rounded to keep the JSON small.
+    coords, starts, index = path_buffers(gdf.geometry.values)
+    vertices = np.round(coords, decimals).tolist()
+    ends = np.append(starts[1:], len(coords))
+    return pd.DataFrame({
+        'path': [vertices[start:end] for start, end in zip(starts.tolist(), ends.tolist())],
+        'color': rgb_colours(gdf[colour].values, default)[index].tolist(),
+        'width': gdf[width].values.astype(np.float64)[index].tolist(),
+    })
+
+def path_layer(gdf, colour='hexcolour', width='linewidth', default='#000000', **kwargs):
+    # pydeck PathLayer fed from path_data, only the notebook needs pydeck so import it here
+    import pydeck as pdk
+    return pdk.Layer(
+        type='PathLayer', data=path_data(gdf, colour, width, default),
+        get_path='path', get_color='color', get_width='width', **kwargs
+    )
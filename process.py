@@ -1,274 +1,432 @@
-import geopandas as gpd
-from shapely.geometry import *
-import numpy as np
-import topojson as tp
-import met_brewer
-import requests
 import os.path
+import sys
 import logging
 import argparse
-import altair as alt
-from altair_saver import save
 from itertools import cycle
+import lazy
+import cache
+import jobs
+import profiling
+import build
+import regions
 
-alt.data_transformers.disable_max_rows()
+# Heavy dependencies, and the modules that use them, are only imported once a stage or backend needs them,
+# so that --help and runs that skip stages start quickly
+gpd = lazy.module('geopandas')
+pd = lazy.module('pandas')
+met_brewer = lazy.module('met_brewer')
+tp = lazy.module('topojson')
+alt = lazy.module('altair')
+altair_saver = lazy.module('altair_saver')
+download = lazy.module('download')
+lod = lazy.module('lod')
+raster = lazy.module('raster')
+tiles = lazy.module('tiles')
+reader = lazy.module('reader')
+basins = lazy.module('basins')
+border = lazy.module('border')
+compact = lazy.module('compact')
+network = lazy.module('network')
 
-def download_file_if_not_exists(url, fname=None):
-    if fname is None:
-        fname = os.path.basename(url)
-    if not os.path.isfile(fname):
-        session = requests.Session()
-        with session.get(url, stream=True) as stream:
-            stream.raise_for_status()
-            with open(fname, 'wb') as f:
-                for chunk in stream.iter_content(chunk_size=8192): 
-                    f.write(chunk)
+# Ireland region from regions/ireland.json: its bounding box, the corner of that covering part of
+# Scotland, and the Hydro chart size and title. The geometries are built by regions.exclude and
+# regions.mask when the rivers are read.
+IRELAND_FILE = os.path.join(regions.REGIONS_DIR, 'ireland.json')
+IRELAND = regions.load(IRELAND_FILE, geometry=False)
+IRELAND_BBOX = IRELAND['bbox']
+
+# Chart sizes (width, height) in pixels
+HYDRO_SIZE = IRELAND['size']
+NI_SIZE = (2000, 2000)
+ROI_SIZE = (2000, 2600)
+
+# Outputs: file prefix, lake and river layers, chart size and title
+MAPS = {
+    'Hydro': ('hydrorivers_hydrobasins', [], ['hydrorivers'], HYDRO_SIZE, tuple(IRELAND['title'])),
+    'NI': ('ni_rivers_lakes', ['nilakes'], ['nirivers'], NI_SIZE, ("Northern Ireland's river basins", 'Based on DAERA and HydroBasins datasets')),
+    'ROI': ('roi_rivers_lakes', ['roilakes'], ['roirivers'], ROI_SIZE, ("Republic of Ireland's river basins", 'Based on EPA, OSi and HydroBasins datasets')),
+    'IE': ('ie_rivers_lakes', ['nilakes', 'roilakes'], ['nirivers', 'roirivers'], ROI_SIZE, ("Ireland's river basins", 'Based on DAERA, EPA, OSi and HydroBasins datasets')),
+    'Border': ('border_rivers_lakes', ['bordernilakes', 'borderroilakes'], ['bordernirivers', 'borderroirivers'], ROI_SIZE, ('Rivers around NI/ROI border', 'Based on DAERA, EPA, OSi and HydroBasins datasets')),
+}
+# Chart size each layer is simplified for, and the Strahler order column used to thin out tiles
+LAYER_SIZES = {'hydrorivers': HYDRO_SIZE, 'nirivers': NI_SIZE, 'nilakes': NI_SIZE, 'roirivers': ROI_SIZE, 'roilakes': ROI_SIZE}
+ORDER_COLUMNS = {'hydrorivers': 'ORD_STRA', 'nirivers': 'strahler', 'roirivers': 'ORDER_'}
+# Maps whose layers, and so sources, each output is drawn from
+OUTPUT_MAPS = {'Hydro': ['Hydro'], 'NI': ['NI'], 'ROI': ['ROI'], 'IE': ['NI', 'ROI'], 'Border': ['NI', 'ROI', 'Border']}
+
+# Where the html-topojson backend writes the layers shared between charts
+DATA_DIR = 'data'
+
+HYBAS_ZIP = IRELAND['basins']
+HYDRORIVERS_ZIP = IRELAND['rivers']
+
+def load_basins(basinlevel, cachedir=None):
+    return cache.cached_layer(
+        f'hybas_lev{basinlevel:02d}', [HYBAS_ZIP], {'bbox': IRELAND_BBOX},
+        lambda: reader.read_layer(HYBAS_ZIP, layer=basins.layer_name(basinlevel), bbox=IRELAND_BBOX),
+        cachedir
+    )
+
+def load_hierarchy(cachedir=None):
+    return cache.cached_layer(
+        'hybas_hierarchy', [HYBAS_ZIP], {'bbox': IRELAND_BBOX},
+        lambda: basins.load_hierarchy(HYBAS_ZIP, IRELAND_BBOX),
+        cachedir, geo=False
+    )
+
+def cached_join(name, fname, hierarchy, lev12, cachedir=None, crs='4326'):
+    # Read, reproject and assign basins at every level to a layer, or fetch the result of a previous run from the cache
+    def loader():
+        with profiling.stage('read', layer=name):
+            gdf = reader.read_layer(fname)
+            profiling.record_layer(gdf)
+        with profiling.stage('reproject', layer=name):
+            gdf.geometry = gdf.geometry.to_crs(crs)
+        with profiling.stage('join', layer=name):
+            return basins.assign_levels(gdf, hierarchy, lev12)
+    return cache.cached_layer(
+        name, [fname, HYBAS_ZIP], {'crs': crs, 'bbox': IRELAND_BBOX},
+        loader, cachedir
+    )
+
+def load_hydro(hierarchy, strahlerpower, cachedir=None, outlet=False, minlength=0, minorder=0, catchment=None):
+    # Get Hydrorivers data for Ireland and cut off the Scotland area of the bounding box. The river network
+    # can then be cut down to the catchments of some reaches, pruned to the larger rivers, and coloured by
+    # the basins of the river mouths rather than of each reach.
+    def loader():
+        # HydroRIVERS already records the level 12 basin of every reach, so the coarser levels are a
+        # lookup on each batch as it streams in, without any spatial join
+        scotland = regions.exclude(IRELAND)
+        return reader.read_batches(
+            HYDRORIVERS_ZIP,
+            lambda eu: basins.assign_levels(eu[~eu.intersects(scotland)], hierarchy),
+            mask=regions.mask(IRELAND)
+        )
+    eugdf = cache.cached_layer(
+        'hydrorivers', [HYDRORIVERS_ZIP, HYBAS_ZIP], {'bbox': IRELAND_BBOX, 'exclude': IRELAND['exclude']},
+        loader, cachedir
+    )
+    if catchment:
+        eugdf = network.catchment(eugdf, catchment)
+    if minlength > 0 or minorder > 0:
+        eugdf = network.prune(eugdf, minlength, minorder)
+    if outlet:
+        eugdf = network.by_outlet(eugdf, [basins.level_column(level) for level in basins.LEVELS])
+    eugdf['linewidth'] = eugdf['ORD_STRA'].pow(strahlerpower)
+    return eugdf
+
+def load_ni(hierarchy, lev12, strahlerpower, cachedir=None):
+    nirivers = cached_join('nirivers', 'ni-rivers-strahler-ranking.zip', hierarchy, lev12, cachedir)
+    nirivers['linewidth'] = nirivers.strahler.pow(strahlerpower)
+
+    nilakes = cached_join('nilakes', 'ni-lake-water-bodies.geojson', hierarchy, lev12, cachedir)
+    return nirivers, nilakes
+
+def load_roi(hierarchy, lev12, strahlerpower, cachedir=None):
+    roirivers = cached_join('roirivers', 'roi-river-netroutes.json', hierarchy, lev12, cachedir)
+    roirivers['linewidth'] = roirivers.ORDER_.pow(strahlerpower)
+
+    roilakes = cached_join('roilakes', 'Lakes_&_Reservoirs_-_OSi_National_250k_Map_Of_Ireland.geojson', hierarchy, lev12, cachedir)
+    return roirivers, roilakes
+
+def basin_colours(eubas, hexcolours):
+    # Cycle through the palette, the first colour is kept for rivers outside any basin
+    colourcycle = cycle(hexcolours[1:])
+    return pd.Series([next(colourcycle) for i in range(len(eubas))], index=eubas['HYBAS_ID'].values)
+
+def apply_colours(gdf, colourmap, default, basinlevel):
+    gdf['hexcolour'] = gdf[basins.level_column(basinlevel)].map(colourmap).fillna(default)
+    return gdf
+
+def load_layers(maps, strahlerpower, lodpixels, borderdistance=5000, cachedir=None, rivernetwork=None):
+    # Load, reproject and assign basins to every layer the maps need once, for all basin levels.
+    # Returns the full detail layers, which tiles simplify per zoom level themselves, and the layers
+    # simplified for the chart sizes. rivernetwork holds the load_hydro network options.
+    hierarchy = load_hierarchy(cachedir)
+    layers = {}
+    if 'Hydro' in maps:
+        layers['hydrorivers'] = load_hydro(hierarchy, strahlerpower, cachedir, **(rivernetwork or {}))
+    if 'NI' in maps or 'ROI' in maps:
+        lev12 = load_basins(12, cachedir)
+    if 'NI' in maps:
+        layers['nirivers'], layers['nilakes'] = load_ni(hierarchy, lev12, strahlerpower, cachedir)
+    if 'ROI' in maps:
+        layers['roirivers'], layers['roilakes'] = load_roi(hierarchy, lev12, strahlerpower, cachedir)
+    # Drop every attribute the maps don't use straight after the join
+    layers = {name: slim(gdf, name) for name, gdf in layers.items()}
+    simplified = {
+        name: lod.simplify_for_canvas(gdf, *LAYER_SIZES[name], lodpixels, name)
+        for name, gdf in layers.items()
+    }
+    if 'Border' in outputs(maps):
+        zone = border.border_zone(borderdistance, cachedir=cachedir)
+        for name in ['nirivers', 'nilakes', 'roirivers', 'roilakes']:
+            with profiling.stage('clip', layer=f'border{name}'):
+                simplified[f'border{name}'] = border.clip(simplified[name], zone)
+                profiling.record_layer(simplified[f'border{name}'])
+    return layers, simplified
+
+def slim(gdf, name):
+    columns = [basins.level_column(level) for level in basins.LEVELS] + ['linewidth', ORDER_COLUMNS.get(name), 'geometry']
+    return gdf[[column for column in columns if column in gdf]]
+
+def outputs(maps):
+    # Maps to render: the combined map replaces NI and ROI with the border region when Border is chosen
+    selected = [m for m in ['Hydro', 'NI', 'ROI'] if m in maps]
+    if 'NI' in maps and 'ROI' in maps:
+        selected.append('Border' if 'Border' in maps else 'IE')
+    return selected
+
+def render_job(job):
+    # Render one map in one palette at one basin level, from the layers shared with every worker
+    output, colour, basinlevel, backend, scale = job
+    layers, eubas = jobs.shared()
+    # Colour schemes from RMetBrewer
+    hexcolours = met_brewer.met_brew(colour)
+    colourmap = basin_colours(eubas[basinlevel], hexcolours)
+    prefix, areas, lines, size, title = MAPS[output]
+    fname = f'{prefix}-{colour}-{basinlevel}'
+    if backend == 'html-topojson':
+        # Layers are already written out, the chart just references them and carries the colour table
+        areas = [shared_chart(name, colourmap, hexcolours[0], basinlevel) for name in areas]
+        lines = [shared_chart(name, colourmap, hexcolours[0], basinlevel) for name in lines]
+        with profiling.stage('save', output=output, colour=colour, basinlevel=basinlevel, backend=backend):
+            fname = save_map(areas, lines, size, title_params(*title), fname, 'html', linewidth='properties.linewidth')
+            profiling.record_file(fname)
+        return fname
+    # Unpack just the geometry, colours and widths, with the first colour for any rivers not in basins
+    with profiling.stage('unpack', output=output, colour=colour, basinlevel=basinlevel):
+        areas = [compact.unpack(layers[name], colourmap, hexcolours[0], basinlevel) for name in areas]
+        lines = [compact.unpack(layers[name], colourmap, hexcolours[0], basinlevel) for name in lines]
+        profiling.record(features=sum(len(gdf) for gdf in areas + lines))
+    with profiling.stage('save', output=output, colour=colour, basinlevel=basinlevel, backend=backend):
+        fname = save_map(areas, lines, size, title_params(*title), fname, backend, scale)
+        profiling.record_file(fname)
+    return fname
+
+def output_sources(output):
+    # Source files of the output's maps, and the Ireland region file its bbox, mask, size and title are from
+    return set(source for m in OUTPUT_MAPS[output] for source in download.MAP_SOURCES[m]) | {IRELAND_FILE}
+
+def render_target(job, params):
+    # Files a render job writes, the chart first then any shared data it references, and its build key
+    output, colour, basinlevel, backend, scale = job
+    prefix, areas, lines, size, title = MAPS[output]
+    files = [f'{prefix}-{colour}-{basinlevel}.{"png" if backend == "png" else "html"}']
+    if backend == 'html-topojson':
+        files += [os.path.join(DATA_DIR, f'{name}.topojson') for name in areas + lines]
+    return job, files, build.target_key(output_sources(output), {'job': job, **params})
+
+def tile_target(job, params):
+    # Tiles are keyed on the viewer page, written once every tile is done
+    output, colour, basinlevel = job
+    files = [os.path.join(f'{MAPS[output][0]}_tiles-{colour}-{basinlevel}', 'index.html')]
+    return job, files, build.target_key(output_sources(output), {'job': job, **params})
+
+def basin_levels(value):
+    # Basin level argument, either a single level or a range such as 5-8
+    first, _, last = value.partition('-')
+    levels = list(range(int(first), int(last or first) + 1))
+    if not levels or levels[0] < 1 or levels[-1] > 12:
+        raise argparse.ArgumentTypeError(f'{value} is not a basin level or range of levels between 1 and 12')
+    return levels
+
+def write_shared_data(layers, datadir=DATA_DIR):
+    # Write each layer once as TopoJSON with quantized arcs, with just the basin IDs and line widths, for
+    # every chart that uses it to reference by URL
+    os.makedirs(datadir, exist_ok=True)
+    levels = [basins.level_column(level) for level in basins.LEVELS]
+    for name, gdf in layers.items():
+        data = gdf[levels].fillna(-1).astype('int64')
+        if 'linewidth' in gdf:
+            data['linewidth'] = gdf['linewidth'].fillna(0)
+        data = gpd.GeoDataFrame(data, geometry=gdf.geometry.values, crs=gdf.crs)
+        tp.Topology(data, prequantize=1e5, object_name='data').to_json(os.path.join(datadir, f'{name}.topojson'))
+
+def shared_chart(name, colourmap, default, basinlevel, datadir=DATA_DIR):
+    # Chart of a layer written by write_shared_data, coloured by looking up each feature's basin in a
+    # small inline colour table
+    colourtable = alt.InlineData(values=[{'basin': int(basin), 'hexcolour': colour} for basin, colour in colourmap.items()])
+    return alt.Chart(
+        alt.UrlData(url=f'{datadir}/{name}.topojson', format=alt.DataFormat(type='topojson', feature='data'))
+    ).transform_lookup(
+        lookup=f'properties.{basins.level_column(basinlevel)}',
+        from_=alt.LookupData(data=colourtable, key='basin', fields=['hexcolour'])
+    ).transform_calculate(
+        hexcolour=f"datum.hexcolour || '{default}'"
+    )
+
+def areas_chart(data):
+    chart = data if isinstance(data, alt.Chart) else alt.Chart(data)
+    return chart.mark_geoshape().encode(
+        color=alt.Color(
+            "hexcolour",
+            type='nominal',
+            scale=None
+        )
+    )
+
+def lines_chart(data, linewidth="linewidth"):
+    chart = data if isinstance(data, alt.Chart) else alt.Chart(data)
+    return chart.mark_geoshape(
+        filled=False,
+    ).encode(
+        strokeWidth=alt.StrokeWidth(
+            linewidth,
+            type='quantitative',
+            legend=None
+        ),
+        color=alt.Color(
+            "hexcolour",
+            type='nominal',
+            scale=None
+        )
+    )
+
+def title_params(text, subtitle, fontsize=80, subtitlefontsize=48):
+    # Plain dict so that the PNG renderer can mirror the Altair title
+    return dict(
+        text=text,
+        subtitle=[subtitle,'Created by Paul Barber'],
+        baseline='bottom',
+        orient='bottom',
+        anchor='end',
+        font='Optima',
+        fontWeight='bold',
+        fontSize=fontsize,
+        dy=-100,
+        color='#fff',
+        subtitleColor='#fff',
+        subtitleFont='Optima',
+        subtitleFontSize=subtitlefontsize,
+        subtitleFontWeight='normal',
+    )
+
+def finish_chart(chart, title):
+    return chart.configure_view(
+        strokeWidth=0
+    ).properties(
+        background = '#000000',
+        title=alt.TitleParams(**title),
+    )
+
+def save_map(areas, lines, size, title, fname, backend='html', scale=1, linewidth='linewidth', projection=None):
+    # Draw lake areas under river lines and save as fname with the backend's extension. Layers are
+    # GeoDataFrames, or for html also charts of shared data. projection is passed to Altair for layers
+    # that aren't in longitude and latitude.
+    if backend == 'png':
+        return raster.render(areas, lines, size, title, f'{fname}.png', scale)
+    alt.data_transformers.disable_max_rows()
+    chart = alt.layer(
+        *[areas_chart(gdf) for gdf in areas],
+        *[lines_chart(gdf, linewidth) for gdf in lines]
+    ).properties(
+        height = size[1],
+        width = size[0]
+    )
+    if projection is not None:
+        chart = chart.project(**projection)
+    altair_saver.save(finish_chart(chart, title), f'{fname}.html', format='html')
+    return f'{fname}.html'
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Create river map of the island of Ireland.')
-    parser.add_argument('--colours', help='RMetBrewer colour scheme (colourblind safe)', default='Hokusai2', choices=met_brewer.COLORBLIND_PALETTES_NAMES)
+    parser.add_argument('--colours', help='RMetBrewer colour scheme (colourblind safe), checked once the arguments are parsed', default='Hokusai2')
     parser.add_argument('--allcolours', help='Try all colour themes', default=False, action='store_true')
-    parser.add_argument('--maps', help='Choose maps to create', nargs='+', default=['Hydro', 'NI', 'ROI'], choices=['Hydro', 'NI', 'ROI', 'Border'])
-    parser.add_argument('--basinlevel', help='Basin level to use', default=7, type=int, choices=range(1,10))
+    parser.add_argument('--maps', help='Choose maps to create', nargs='+', default=['Hydro', 'NI', 'ROI'], choices=['Hydro', 'NI', 'ROI', 'Border', 'Tiles'])
+    parser.add_argument('--basinlevel', help='Basin levels to use, as levels or ranges such as 5-8', nargs='+', default=[[7]], type=basin_levels)
     parser.add_argument('--strahlerpower', help='Exponential to use when calculating line width from Strahler level', default=5.0, type=float)
+    parser.add_argument('--cachedir', help='Directory for cached layers', default=cache.CACHE_DIR)
+    parser.add_argument('--cachesize', help='Maximum size of the layer cache in MB', default=cache.CACHE_SIZE // (1024 * 1024), type=int)
+    parser.add_argument('--nocache', help='Do not read or write cached layers', default=False, action='store_true')
+    parser.add_argument('--downloads', help='Number of source files to download in parallel', default=4, type=int)
+    parser.add_argument('--lod', help='Simplify geometries to this fraction of an output pixel, 0 to keep every vertex', default=0.5, type=float)
+    parser.add_argument('--backend', help='Render maps as Altair HTML, as HTML referencing shared TopoJSON data files, or directly to PNG', default='html', choices=['html', 'png', 'html-topojson'])
+    parser.add_argument('--scale', help='Scale factor for PNG output, for poster sized images', default=1, type=int)
+    parser.add_argument('--tilezooms', help='Lowest and highest zoom levels for Tiles output', nargs=2, default=[6, 12], type=int)
+    parser.add_argument('--borderdistance', help='Width in metres of the zone either side of the NI/ROI border for the Border map', default=5000, type=float)
+    parser.add_argument('--jobs', help='Number of worker processes, defaults to the number of CPUs', default=None, type=int)
+    parser.add_argument('--colourby', help='Colour Hydro rivers by the basin of each reach, or of the outlet of the river it flows into', default='basin', choices=['basin', 'outlet'])
+    parser.add_argument('--minlength', help='Drop Hydro reaches with less than this many km of river upstream', default=0, type=float)
+    parser.add_argument('--minorder', help='Drop Hydro reaches below this Strahler order', default=0, type=int)
+    parser.add_argument('--catchment', help='Only draw the Hydro reaches upstream of these HYRIV_IDs', nargs='+', default=None, type=int)
+    parser.add_argument('--force', help='Rebuild every output, even those that are up to date', default=False, action='store_true')
+    parser.add_argument('--profile', help='Write a JSON trace of the time, memory and feature counts of every stage to this file', nargs='?', const='profile.json', default=None)
+    parser.add_argument('--profiler', help='Also capture a cProfile or pyinstrument profile of each top level stage, into --profiledir', default=None, choices=['cprofile', 'pyinstrument'])
+    parser.add_argument('--profiledir', help='Directory for --profiler output', default='profile')
     args = parser.parse_args()
+    if args.colours not in met_brewer.COLORBLIND_PALETTES_NAMES:
+        parser.error(f'argument --colours: invalid choice: {args.colours!r} (choose from {", ".join(met_brewer.COLORBLIND_PALETTES_NAMES)})')
+    logging.basicConfig(level=logging.INFO)
+    if args.profile or args.profiler:
+        profiling.configure(True, args.profiler, args.profiledir)
+    cachedir = None if args.nocache else args.cachedir
+    basinlevels = sorted(set(level for levels in args.basinlevel for level in levels))
 
     if args.allcolours is True:
         colours = met_brewer.COLORBLIND_PALETTES_NAMES
     else:
         colours = [args.colours]
-    for colour in colours:
-        # Colour schemes from RMetBrewer
+
+    with profiling.stage('download'):
+        download.download_maps(args.maps, jobs=args.downloads)
+
+    # Only build the outputs whose sources, parameters or code have changed since they were last built
+    manifest = build.load()
+    rivernetwork = {'outlet': args.colourby == 'outlet', 'minlength': args.minlength, 'minorder': args.minorder, 'catchment': args.catchment}
+    params = {'strahlerpower': args.strahlerpower, 'lod': args.lod, 'borderdistance': args.borderdistance, **rivernetwork}
+    # Every map in every palette at every basin level is an independent job
+    renders = build.select(manifest, [
+        render_target((output, colour, basinlevel, args.backend, args.scale), params)
+        for basinlevel in basinlevels for colour in colours for output in outputs(args.maps)
+    ], args.force)
+    tilejobs = build.select(manifest, [
+        tile_target((output, colour, basinlevel), {**params, 'tilezooms': args.tilezooms})
+        for basinlevel in basinlevels for colour in colours for output in ['Hydro', 'NI', 'ROI']
+        if 'Tiles' in args.maps and output in args.maps
+    ], args.force)
+    if not renders and not tilejobs:
+        logging.info('Every output is up to date, use --force to rebuild them')
+        sys.exit(0)
+
+    # Load, reproject and join every layer the stale outputs need once for all basin levels, only the
+    # colours change per palette and level. The basins at each level are only needed for the colour order.
+    maps = set(m for (output, *_), files, key in renders + tilejobs for m in OUTPUT_MAPS[output])
+    fulldetail, simplified = load_layers(maps, args.strahlerpower, args.lod, args.borderdistance, cachedir, rivernetwork)
+    eubas = {basinlevel: load_basins(basinlevel, cachedir)[['HYBAS_ID']] for basinlevel in basinlevels}
+    cache.evict(cachedir, args.cachesize * 1024 * 1024)
+
+    if args.backend == 'html-topojson':
+        needed = set(name for (output, *_), files, key in renders for name in MAPS[output][1] + MAPS[output][2])
+        with profiling.stage('shared_data'):
+            write_shared_data({name: gdf for name, gdf in simplified.items() if name in needed})
+
+    # Workers receive the layers in the compact format, whose arrays jobs.run moves into memory-mapped
+    # files rather than copying them into every worker, so packed isn't usable after the run
+    with profiling.stage('pack'):
+        packed = {name: compact.pack(gdf) for name, gdf in simplified.items()}
+    del simplified
+    with profiling.stage('render', jobs=len(renders)):
+        jobs.run(render_job, [job for job, files, key in renders], (packed, eubas), args.jobs)
+    for job, files, key in renders:
+        build.mark(manifest, files, key)
+    build.save(manifest)
+
+    # Tiles run their own process pool per pyramid, so are cut after the render jobs
+    for (output, colour, basinlevel), files, key in tilejobs:
         hexcolours = met_brewer.met_brew(colour)
-        # Get Hydrobasins data for Ireland and apply colours
-        eubas = gpd.read_file('hybas_eu_lev01-12_v1c.zip', layer=f'hybas_eu_lev0{args.basinlevel}_v1c', bbox=(-10.56,51.39,-5.34,55.43))
-        logging.info('Colouring {basins} basins with {colours} colours'.format(basins = len(eubas), colours = len(hexcolours)))
-        colourcycle = cycle(hexcolours[1:])
-        eubas["hexcolour"] = [next(colourcycle)for i in range(len(eubas))]
-
-        if 'Hydro' in args.maps:
-            # Get Hydrorivers data for Ireland and cut off the Scotland area of the bounding box
-            download_file_if_not_exists('https://data.hydrosheds.org/file/HydroRIVERS/HydroRIVERS_v10_eu.gdb.zip')
-            eu = gpd.read_file('HydroRIVERS_v10_eu.gdb.zip', bbox=(-10.56,51.39,-5.34,55.43))
-            eu = eu[~eu.intersects(Polygon([
-                (-5.34, 55.43), 
-                (-5.85, 55.43), 
-                (-5.85, 55.23), 
-                (-5.34, 55.23)
-                ]
-            ))]
-            download_file_if_not_exists('https://data.hydrosheds.org/file/hydrobasins/standard/hybas_eu_lev01-12_v1c.zip')
-            # Spatial join of rivers to basins
-            eugdf = eu.sjoin(eubas, how='left')
-            # Add colour for any rivers not in basins
-            eugdf["hexcolour"] = eugdf["hexcolour"].apply(lambda x: hexcolours[0] if x is np.nan else x)
-
-            eugdf['linewidth'] = eugdf['ORD_STRA'].pow(args.strahlerpower)
-
-            lines = alt.Chart(eugdf).mark_geoshape(
-                filled=False,
-            ).encode(
-                strokeWidth=alt.StrokeWidth(
-                    "linewidth",
-                    legend=None
-                ),
-                color=alt.Color(
-                    "hexcolour", 
-                    scale=None
-                )
-            ).configure_view(
-                strokeWidth=0
-            ).properties(
-                height = 2600,
-                width = 2000,
-                background = '#000000',
-                title=alt.TitleParams(
-                    text="Ireland's river basins",
-                    subtitle=['Based on HydroRivers and HydroBasins datasets','Created by Paul Barber'],
-                    baseline='bottom',
-                    orient='bottom',
-                    anchor='end',
-                    font='Optima',
-                    fontWeight='bold',
-                    fontSize=40,
-                    dy=-100,
-                    color='#fff',
-                    subtitleColor='#fff',
-                    subtitleFont='Optima',
-                    subtitleFontSize=24,
-                    subtitleFontWeight='normal',
-                ),
-            )
-
-            save(lines, f'hydrorivers_hydrobasins-{colour}-{args.basinlevel}.html', format='html')
-
-        if 'Border' in args.maps:
-            download_file_if_not_exists('https://opendata.arcgis.com/api/v3/datasets/577487bb7ce94c76b5a7a5f6c29e6ee9_0/downloads/data?format=shp&spatialRefId=2157&where=1%3D1', 'ROI_landmask.zip')
-            roioutline = gpd.read_file('ROI_landmask.zip')
-            roioutline.geometry = roioutline.geometry.to_crs('4326')
-            download_file_if_not_exists('http://osni-spatialni.opendata.arcgis.com/datasets/159c80fe1ad54140b429f8799f624962_0.zip', 'NI_land_area.zip')
-            niboundary = gpd.read_file('NI_land_area.zip')
-            niboundary.geometry = niboundary.geometry.to_crs('4326')
-            # Extend the NI boundary by 0.015 units
-            niboundary['geometry'] = niboundary.buffer(0.015)
-            bbox = box(-8.415527,-5.605774,53.998083,55.152197)
-            # Identify ROI border within the extended NI boundary, and apply a bounding box to remove point where
-            # boundaries get too close
-            border = gpd.clip(roioutline.boundary.clip(niboundary), mask=bbox)
-            # Create a buffer zone 5km round the border
-            border = border.to_crs('EPSG:29902')
-            buffer = border.buffer(5000)
-            buffer = buffer.to_crs('EPSG:4326')
-
-        if 'NI' in args.maps:
-            download_file_if_not_exists('https://opendata-daerani.hub.arcgis.com/datasets/DAERANI::rivers-strahler-ranking.zip?outSR=%7B%22latestWkid%22%3A29902%2C%22wkid%22%3A29900%7D', 'ni-rivers-strahler-ranking.zip')
-            nirivers = gpd.read_file('ni-rivers-strahler-ranking.zip')
-            nirivers.geometry = nirivers.geometry.to_crs('4326')
-            nirivers['linewidth'] = nirivers.strahler.pow(args.strahlerpower)
-            nirivers = nirivers.sjoin(eubas, how='left')
-
-            download_file_if_not_exists('https://opendata-daerani.hub.arcgis.com/datasets/DAERANI::lake-water-bodies.geojson?outSR=%7B%22latestWkid%22%3A29902%2C%22wkid%22%3A29900%7D', 'ni-lake-water-bodies.geojson')
-            nilakes = gpd.read_file('ni-lake-water-bodies.geojson')
-            nilakes.geometry = nilakes.geometry.to_crs('4326')
-            nilakes = nilakes.sjoin(eubas, how='left')
-
-            niareas = alt.Chart(nilakes).mark_geoshape().encode(
-                color=alt.Color(
-                    "hexcolour", 
-                    scale=None
-                )
-            )
-
-            nilines = alt.Chart(nirivers).mark_geoshape(
-                filled=False,
-            ).encode(
-                strokeWidth=alt.StrokeWidth(
-                    "linewidth",
-                    legend=None
-                ),
-                color=alt.Color(
-                    "hexcolour", 
-                    scale=None
-                )
-            )
-
-            ni = alt.layer(
-                niareas.properties(
-                    height = 2000,
-                    width = 2000
-                ),
-                nilines).configure_view(
-                strokeWidth=0
-            ).properties(
-                background = '#000000',
-                title=alt.TitleParams(
-                    text="Northern Ireland's river basins",
-                    subtitle=['Based on DAERA and HydroBasins datasets','Created by Paul Barber'],
-                    baseline='bottom',
-                    orient='bottom',
-                    anchor='end',
-                    font='Optima',
-                    fontWeight='bold',
-                    fontSize=80,
-                    dy=-100,
-                    color='#fff',
-                    subtitleColor='#fff',
-                    subtitleFont='Optima',
-                    subtitleFontSize=48,
-                    subtitleFontWeight='normal',
-                ),
-            )
-
-            save(ni, f'ni_rivers_lakes-{colour}-{args.basinlevel}.html', format='html')
-
-        if 'ROI' in args.maps:
-            download_file_if_not_exists('http://gis.epa.ie/geoserver/EPA/ows?service=WFS&version=1.0.0&request=GetFeature&typeName=EPA:WATER_RIVNETROUTES&outputFormat=application%2Fjson&srsName=EPSG:4326', 'roi-river-netroutes.json')
-            roirivers = gpd.read_file('roi-river-netroutes.json')
-            roirivers.geometry = roirivers.geometry.to_crs('4326')
-            roirivers['linewidth'] = roirivers.ORDER_.pow(args.strahlerpower)
-            roirivers = roirivers.sjoin(eubas, how='left')
-
-            download_file_if_not_exists('https://opendata.arcgis.com/api/v3/datasets/0081128602fa45f49fe4f56e159040b3_0/downloads/data?format=geojson&spatialRefId=4326&where=1%3D1', 'Lakes_&_Reservoirs_-_OSi_National_250k_Map_Of_Ireland.geojson')
-            roilakes = gpd.read_file('Lakes_&_Reservoirs_-_OSi_National_250k_Map_Of_Ireland.geojson')
-            roilakes.geometry = roilakes.geometry.to_crs('4326')
-            roilakes = roilakes.sjoin(eubas, how='left')
-
-            roiareas = alt.Chart(roilakes).mark_geoshape().encode(
-                color=alt.Color(
-                    "hexcolour", 
-                    scale=None
-                )
-            )
-
-            roilines = alt.Chart(roirivers).mark_geoshape(
-                filled=False,
-            ).encode(
-                strokeWidth=alt.StrokeWidth(
-                    "linewidth",
-                    legend=None
-                ),
-                color=alt.Color(
-                    "hexcolour", 
-                    scale=None
-                )
-            ).properties(
-                height = 2600,
-                width = 2000
-            )
-
-            roi = alt.layer(roiareas, roilines).configure_view(
-                strokeWidth=0
-            ).properties(
-                background = '#000000',
-                title=alt.TitleParams(
-                    text="Republic of Ireland's river basins",
-                    subtitle=['Based on EPA, OSi and HydroBasins datasets','Created by Paul Barber'],
-                    baseline='bottom',
-                    orient='bottom',
-                    anchor='end',
-                    font='Optima',
-                    fontWeight='bold',
-                    fontSize=80,
-                    dy=-100,
-                    color='#fff',
-                    subtitleColor='#fff',
-                    subtitleFont='Optima',
-                    subtitleFontSize=48,
-                    subtitleFontWeight='normal',
-                ),
-            )
-            save(roi, f'roi_rivers_lakes-{colour}-{args.basinlevel}.html', format='html')
-
-        if 'ROI' in args.maps and 'NI' in args.maps:
-            if 'Border' in args.maps:
-                title = 'Rivers around NI/ROI border'
-                fname = f'border_rivers_lakes-{colour}-{args.basinlevel}.html'
-                nirivers = nirivers.clip(buffer)
-                nilakes = nilakes.clip(buffer)
-                roirivers = roirivers.clip(buffer)
-                roilakes = roilakes.clip(buffer)
-            else:
-                title = "Ireland's river basins"
-                fname = f'ie_rivers_lakes-{colour}-{args.basinlevel}.html'
-            ie = alt.layer(niareas, roiareas, nilines, roilines).configure_view(
-                strokeWidth=0
-            ).properties(
-                background = '#000000',
-                title=alt.TitleParams(
-                    text=title,
-                    subtitle=['Based on DAERA, EPA, OSi and HydroBasins datasets','Created by Paul Barber'],
-                    baseline='bottom',
-                    orient='bottom',
-                    anchor='end',
-                    font='Optima',
-                    fontWeight='bold',
-                    fontSize=80,
-                    dy=-100,
-                    color='#fff',
-                    subtitleColor='#fff',
-                    subtitleFont='Optima',
-                    subtitleFontSize=48,
-                    subtitleFontWeight='normal',
-                ),
-            )
-            save(ie, fname, format='html')
+        colourmap = basin_colours(eubas[basinlevel], hexcolours)
+        prefix, areas, lines, size, title = MAPS[output]
+        tilelayers = [
+            tiles.tile_layer(apply_colours(fulldetail[name], colourmap, hexcolours[0], basinlevel), name) for name in areas
+        ] + [
+            tiles.tile_layer(apply_colours(fulldetail[name], colourmap, hexcolours[0], basinlevel), name, ORDER_COLUMNS[name]) for name in lines
+        ]
+        with profiling.stage('tiles', output=output, colour=colour, basinlevel=basinlevel):
+            tiles.generate(tilelayers, f'{prefix}_tiles-{colour}-{basinlevel}', *args.tilezooms, args.jobs, title[0], IRELAND_BBOX)
+        build.mark(manifest, files, key)
+        build.save(manifest)
+
+    if args.profile:
+        profiling.write(args.profile, args=vars(args))
+        logging.info(f'Wrote profile trace to {args.profile}')
@@ -0,0 +1,123 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import resource
+import time
+
+# Instrumentation state for this process, off unless configure is called. Worker processes are given
+# the parent's settings by jobs.run, and hand their events back with each job's result.
+_settings = {'enabled': False, 'profiler': None, 'profiledir': 'profile'}
+_events = []
+_active = []
+_profiles = itertools.count()
+
+def configure(enabled=True, profiler=None, profiledir='profile'):
+    # Also forgets any stages a forked worker process inherited from its parent
+    _settings.update(enabled=enabled, profiler=profiler, profiledir=profiledir)
+    _events.clear()
+    _active.clear()
+
+def settings():
+    return dict(_settings)
+
+def enabled():
+    return _settings['enabled']
+
+def _start_profiler(name):
+    # Capture a cProfile or pyinstrument profile of the outermost stage only, as profilers can't nest
+    if _settings['profiler'] is None or any(profiler for _, profiler in _active):
+        return None
+    if _settings['profiler'] == 'pyinstrument':
+        import pyinstrument
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+def _stop_profiler(profiler, name):
+    os.makedirs(_settings['profiledir'], exist_ok=True)
+    fname = os.path.join(_settings['profiledir'], f'{os.getpid()}-{next(_profiles)}-{name}'.replace(' ', '_').replace('/', '_'))
+    if _settings['profiler'] == 'pyinstrument':
+        profiler.stop()
+        with open(f'{fname}.html', 'w') as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        profiler.dump_stats(f'{fname}.prof')
+
+@contextlib.contextmanager
+def stage(name, **info):
+    # Time a stage of the pipeline, recording the process's peak memory and anything passed to record
+    if not _settings['enabled']:
+        yield
+        return
+    event = {'stage': name, 'pid': os.getpid(), **info}
+    profiler = _start_profiler(name)
+    _active.append((event, profiler))
+    start = time.perf_counter()
+    event['start'] = time.time()
+    try:
+        yield
+    finally:
+        event['seconds'] = time.perf_counter() - start
+        event['maxrss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        _active.pop()
+        if profiler is not None:
+            _stop_profiler(profiler, name)
+        _events.append(event)
+
+def record(**values):
+    # Add counts to the innermost running stage
+    if _settings['enabled'] and _active:
+        _active[-1][0].update(values)
+
+def record_layer(gdf):
+    # Feature and, for a GeoDataFrame, vertex counts of a layer, only worked out when profiling
+    if _settings['enabled'] and _active:
+        record(features=len(gdf))
+        if hasattr(gdf, 'geometry'):
+            import shapely
+            record(vertices=int(shapely.get_num_coordinates(gdf.geometry.values).sum()))
+
+def record_file(fname):
+    record(fname=fname, bytes=os.path.getsize(fname))
+
+def drain():
+    # Remove and return the events recorded so far
+    events = list(_events)
+    _events.clear()
+    return events
+
+def extend(events):
+    _events.extend(events)
+
+def write(fname, **info):
+    with open(fname, 'w') as f:
+        json.dump({**info, 'events': drain()}, f, indent=2)
+
+def totals(trace):
+    # Total seconds for each stage name across a trace
+    result = {}
+    for event in trace['events']:
+        result[event['stage']] = result.get(event['stage'], 0) + event['seconds']
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the stage timings of two process.py --profile traces.')
+    parser.add_argument('before', help='Trace of the earlier run')
+    parser.add_argument('after', help='Trace of the later run')
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before = totals(json.load(f))
+    with open(args.after) as f:
+        after = totals(json.load(f))
+    for name in sorted(set(before) | set(after), key=lambda name: -after.get(name, 0)):
+        b = before.get(name, 0)
+        a = after.get(name, 0)
+        change = f'{(a - b) / b:+.0%}' if b else 'new'
+        print(f'{name:30} {b:9.3f}s {a:9.3f}s {change:>8}')
@@ -0,0 +1,103 @@
+import numpy as np
+import shapely
+from PIL import Image, ImageDraw, ImageFont
+from paths import path_buffers, split_paths
+
+# Vega-Lite's default strokeWidth range, so line widths match the HTML charts
+MIN_STROKE = 1
+MAX_STROKE = 4
+FONTS = {
+    'normal': ['Optima.ttc', 'Optima', 'DejaVuSans.ttf'],
+    'bold': ['Optima Bold.ttf', 'Optima.ttc', 'DejaVuSans-Bold.ttf'],
+}
+
+def fit(bounds, width, height, geographic=True):
+    # Scale and centre to fill the canvas. Longitude and latitude get an equirectangular projection about
+    # the centre latitude, while projected coordinates are already flat so are drawn 1:1.
+    minx, miny, maxx, maxy = bounds
+    aspect = np.cos(np.radians((miny + maxy) / 2)) if geographic else 1
+    scale = min(width / ((maxx - minx) * aspect), height / (maxy - miny))
+    xoff = (width - (maxx - minx) * aspect * scale) / 2
+    yoff = (height - (maxy - miny) * scale) / 2
+    def project(coords):
+        x = (coords[:, 0] - minx) * aspect * scale + xoff
+        y = height - ((coords[:, 1] - miny) * scale + yoff)
+        return np.column_stack([x, y])
+    return project
+
+def project_paths(paths, project):
+    # Project every vertex in one pass, then split back into one array per path
+    coords, starts, index = path_buffers(paths)
+    return split_paths(project(coords), starts)
+
+def ring_paths(gdf):
+    # Polygon rings, with a flag marking which are exteriors rather than holes
+    parts, index = shapely.get_parts(gdf.geometry.values, return_index=True)
+    rings, ringindex = shapely.get_rings(parts, return_index=True)
+    exterior = np.r_[True, ringindex[1:] != ringindex[:-1]] if len(rings) else np.array([], dtype=bool)
+    return rings, index[ringindex], exterior
+
+def stroke_widths(linewidth, maxwidth, scale):
+    return np.maximum(1, np.rint((MIN_STROKE + (MAX_STROKE - MIN_STROKE) * linewidth / maxwidth) * scale)).astype(int)
+
+def load_font(weight, size):
+    for name in FONTS[weight]:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+def draw_title(image, title, height, scale):
+    # Mirror the Altair TitleParams: anchored bottom right below the plot, shifted up by dy
+    draw = ImageDraw.Draw(image)
+    font = load_font(title['fontWeight'], int(title['fontSize'] * scale))
+    subfont = load_font(title['subtitleFontWeight'], int(title['subtitleFontSize'] * scale))
+    x = image.width - 10 * scale
+    y = height + title['dy'] * scale
+    draw.text((x, y), title['text'], font=font, fill=title['color'], anchor='rb')
+    for line in title['subtitle']:
+        y += title['subtitleFontSize'] * 1.25 * scale
+        draw.text((x, y), line, font=subfont, fill=title['subtitleColor'], anchor='rb')
+
+def draw_layers(image, areas, lines, frames, factor, background):
+    # Draw lake polygons then river lines, each coloured by hexcolour, fitted to the non-empty frames
+    bounds = np.array([gdf.total_bounds for gdf in frames])
+    # Layers without a CRS are taken to be in longitude and latitude, as the sources are
+    geographic = frames[0].crs is None or frames[0].crs.is_geographic
+    project = fit((bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()), image.width, image.height, geographic)
+    draw = ImageDraw.Draw(image)
+    for gdf in areas:
+        rings, index, exterior = ring_paths(gdf)
+        colours = gdf['hexcolour'].values[index]
+        for ring, colour, outer in zip(project_paths(rings, project), colours, exterior):
+            if len(ring) > 2:
+                draw.polygon(ring.ravel().tolist(), fill=colour if outer else background)
+    maxwidth = max([gdf['linewidth'].max() for gdf in lines if len(gdf)] + [1])
+    for gdf in lines:
+        coords, starts, index = path_buffers(gdf.geometry.values)
+        colours = gdf['hexcolour'].values[index]
+        widths = stroke_widths(gdf['linewidth'].values[index], maxwidth, factor)
+        for path, colour, linewidth in zip(split_paths(project(coords), starts), colours, widths):
+            if len(path) > 1:
+                draw.line(path.ravel().tolist(), fill=colour, width=int(linewidth), joint='curve')
+
+def render(areas, lines, size, title, fname, scale=1, supersample=2, background='#000000'):
+    # Draw the layers straight into a PNG under the title
+    width, height = size
+    factor = scale * supersample
+    image = Image.new('RGB', (width * factor, height * factor), background)
+    frames = [gdf for gdf in areas + lines if len(gdf)]
+    # If every layer is empty there's nothing to fit to, so only the title is drawn, on a blank canvas
+    if frames:
+        draw_layers(image, areas, lines, frames, factor, background)
+
+    if supersample > 1:
+        image = image.resize((width * scale, height * scale), Image.LANCZOS)
+    # Extra space below the plot for the title, as Vega-Lite adds for a bottom title
+    titleheight = int((title['fontSize'] + 1.25 * title['subtitleFontSize'] * len(title['subtitle'])) * scale)
+    canvas = Image.new('RGB', (image.width, image.height + titleheight), background)
+    canvas.paste(image, (0, 0))
+    draw_title(canvas, title, image.height + titleheight - 1.25 * title['subtitleFontSize'] * len(title['subtitle']) * scale, scale)
+    canvas.save(fname)
+    return fname
@@ -0,0 +1,54 @@
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import mapping
+
+# pyogrio reads through GDAL's Arrow interface, which is much faster than Fiona's feature by feature
+# path. Fall back to Fiona if it isn't installed.
+try:
+    import pyogrio
+    import pyogrio.raw
+except ImportError:
+    pyogrio = None
+
+BATCH_SIZE = 65536
+
+def read_layer(fname, layer=None, bbox=None, mask=None, columns=None, geometry=True):
+    # Read the features intersecting mask (or bbox) in one go, with the spatial filter applied by GDAL.
+    # Without geometry a plain DataFrame of the attributes is returned.
+    if pyogrio is not None:
+        return pyogrio.read_dataframe(fname, layer=layer, bbox=None if mask is not None else bbox, mask=mask, columns=columns, read_geometry=geometry, use_arrow=True)
+    gdf = gpd.read_file(fname, layer=layer, bbox=None if mask is not None else bbox, mask=mask, ignore_geometry=not geometry)
+    return gdf if columns is None else gdf[list(columns) + (['geometry'] if geometry else [])]
+
+def iter_batches(fname, layer=None, bbox=None, mask=None, columns=None, batch_size=BATCH_SIZE):
+    # Stream the features intersecting mask (or bbox) as GeoDataFrames of at most batch_size rows
+    # use_pyarrow gives an iterable RecordBatchReader, rather than the bare Arrow stream of newer pyogrio
+    if pyogrio is not None:
+        with pyogrio.raw.open_arrow(fname, layer=layer, bbox=None if mask is not None else bbox, mask=mask, columns=columns, batch_size=batch_size, use_pyarrow=True) as (meta, stream):
+            geometry = meta['geometry_name'] or 'wkb_geometry'
+            for batch in stream:
+                df = batch.to_pandas()
+                yield gpd.GeoDataFrame(
+                    df.drop(columns=[geometry]),
+                    geometry=gpd.GeoSeries.from_wkb(df[geometry]),
+                    crs=meta['crs']
+                )
+        return
+    import fiona
+    with fiona.open(fname, layer=layer) as src:
+        features = src.filter(mask=mapping(mask)) if mask is not None else src.filter(bbox=bbox)
+        batch = []
+        for feature in features:
+            batch.append(feature)
+            if len(batch) == batch_size:
+                yield gpd.GeoDataFrame.from_features(batch, crs=src.crs)
+                batch = []
+        if batch:
+            yield gpd.GeoDataFrame.from_features(batch, crs=src.crs)
+
+def read_batches(fname, transform, layer=None, bbox=None, mask=None, columns=None, batch_size=BATCH_SIZE):
+    # Stream the layer through transform one batch at a time, so only the transformed rows are kept in memory
+    frames = [transform(batch) for batch in iter_batches(fname, layer, bbox, mask, columns, batch_size)]
+    if not frames:
+        return transform(read_layer(fname, layer, bbox, mask, columns))
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=frames[0].crs)
@@ -0,0 +1,35 @@
+import json
+import os
+import lazy
+
+shapely = lazy.module('shapely')
+
+# Region definitions, one JSON file per region named after it
+REGIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regions')
+
+def sources(continent):
+    # HydroBASINS and HydroRIVERS archives covering a continent
+    return f'hybas_{continent}_lev01-12_v1c.zip', f'HydroRIVERS_v10_{continent}.gdb.zip'
+
+def exclude(region):
+    # Union of the polygons cut out of the region's bounding box
+    return shapely.union_all([shapely.Polygon(coords) for coords in region.get('exclude', [])])
+
+def mask(region):
+    # Area to read, the bbox less the excluded polygons
+    return shapely.box(*region['bbox']).difference(exclude(region))
+
+def load(name_or_fname, geometry=True):
+    # Region from a JSON file, or by name from REGIONS_DIR, with the source archives for its continent.
+    # With geometry, the excluded polygons and the mask replace the exclude coordinates.
+    fname = name_or_fname if name_or_fname.endswith('.json') else os.path.join(REGIONS_DIR, f'{name_or_fname}.json')
+    with open(fname) as f:
+        region = json.load(f)
+    region['name'] = region.get('name', os.path.splitext(os.path.basename(fname))[0])
+    region['bbox'] = tuple(region['bbox'])
+    region['size'] = tuple(region['size'])
+    region['basins'], region['rivers'] = sources(region.get('continent', 'eu'))
+    if geometry:
+        region['mask'] = mask(region)
+        region['exclude'] = exclude(region)
+    return region
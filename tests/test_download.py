@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import http.server
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+requests = pytest.importorskip('requests')
+import download
+
+BODY = bytes(range(256)) * 4096
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # /range honours Range requests, /norange always sends the whole body. Either gzips the body when
+    # the client accepts it, as many servers do.
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        start = 0
+        status = 200
+        if self.path == '/range' and 'Range' in self.headers:
+            start = int(self.headers['Range'].removeprefix('bytes=').rstrip('-'))
+            if start >= len(BODY):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(BODY)}')
+                self.end_headers()
+                return
+            status = 206
+        body = BODY[start:]
+        self.send_response(status)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{len(BODY) - 1}/{len(BODY)}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def url(server, path):
+    return f'http://127.0.0.1:{server.server_address[1]}{path}'
+
+def test_full_download(server, tmp_path):
+    fname = str(tmp_path / 'source')
+    download.download(download.make_session(1), url(server, '/range'), fname)
+    with open(fname, 'rb') as f:
+        assert f.read() == BODY
+    assert server.requests[0]['Accept-Encoding'] == 'identity'
+    assert not os.path.exists(fname + '.part')
+
+def test_resume(server, tmp_path):
+    fname = str(tmp_path / 'source')
+    with open(fname + '.part', 'wb') as f:
+        f.write(BODY[:1000])
+    download.download(download.make_session(1), url(server, '/range'), fname)
+    with open(fname, 'rb') as f:
+        assert f.read() == BODY
+    assert server.requests[0]['Range'] == 'bytes=1000-'
+
+def test_range_ignored(server, tmp_path):
+    fname = str(tmp_path / 'source')
+    with open(fname + '.part', 'wb') as f:
+        f.write(b'x' * 1000)
+    download.download(download.make_session(1), url(server, '/norange'), fname)
+    with open(fname, 'rb') as f:
+        assert f.read() == BODY
+
+def test_already_complete(server, tmp_path):
+    fname = str(tmp_path / 'source')
+    with open(fname + '.part', 'wb') as f:
+        f.write(BODY)
+    download.download(download.make_session(1), url(server, '/range'), fname)
+    with open(fname, 'rb') as f:
+        assert f.read() == BODY
+
+def test_checksum_mismatch(server, tmp_path):
+    fname = str(tmp_path / 'source')
+    with pytest.raises(ValueError):
+        download.download(download.make_session(1), url(server, '/range'), fname, {'sha256': '0' * 64})
+    assert not os.path.exists(fname)
+    assert not os.path.exists(fname + '.part')
+
+def test_download_sources(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manifest = {
+        name: {'url': url(server, '/range'), 'size': len(BODY), 'sha256': hashlib.sha256(BODY).hexdigest()}
+        for name in ['a', 'b', 'c']
+    }
+    assert download.download_sources(list(manifest), manifest, jobs=3) == ['a', 'b', 'c']
+    for name in manifest:
+        with open(name, 'rb') as f:
+            assert f.read() == BODY
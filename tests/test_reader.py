@@ -0,0 +1,34 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+gpd = pytest.importorskip('geopandas')
+pytest.importorskip('pyogrio')
+pytest.importorskip('pyarrow')
+import shapely
+import reader
+
+@pytest.fixture
+def rivers(tmp_path):
+    # A GeoPackage of short lines along a diagonal, one per unit square
+    fname = str(tmp_path / 'rivers.gpkg')
+    gdf = gpd.GeoDataFrame(
+        {'HYRIV_ID': range(100)},
+        geometry=[shapely.LineString([(i, i), (i + 0.5, i + 0.5)]) for i in range(100)],
+        crs='EPSG:4326'
+    )
+    gdf.to_file(fname, driver='GPKG')
+    return fname
+
+def test_iter_batches_mask(rivers):
+    batches = list(reader.iter_batches(rivers, mask=shapely.box(9.9, 9.9, 40.1, 40.1), batch_size=8))
+    assert len(batches) > 1
+    assert all(len(batch) <= 8 for batch in batches)
+    assert [id for batch in batches for id in batch['HYRIV_ID']] == list(range(10, 41))
+    assert batches[0].crs == 'EPSG:4326'
+
+def test_read_batches(rivers):
+    gdf = reader.read_batches(rivers, lambda batch: batch[batch['HYRIV_ID'] % 2 == 0], bbox=(0, 0, 19.9, 19.9), batch_size=4)
+    assert list(gdf['HYRIV_ID']) == list(range(0, 20, 2))
+    assert gdf.geometry.geom_type.eq('LineString').all()
@@ -0,0 +1,189 @@
+import json
+import logging
+import math
+import os
+import numpy as np
+import shapely
+import compact
+import jobs
+
+TILE_SIZE = 256
+
+def lonlat_to_tile(lon, lat, z):
+    n = 2 ** z
+    x = int((lon + 180) / 360 * n)
+    lat = math.radians(max(-85.0511, min(85.0511, lat)))
+    y = int((1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * n)
+    return max(0, min(n - 1, x)), max(0, min(n - 1, y))
+
+def tile_bounds(x, y, z):
+    n = 2 ** z
+    def lat(t):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * t / n))))
+    return (x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y))
+
+def min_order(z, minzoom, maxorder):
+    # Only the two largest Strahler orders at the lowest zoom, then one more order for each zoom level in
+    return max(1, maxorder - 1 - (z - minzoom))
+
+def tile_layer(gdf, name, order=None):
+    # Slim copy of a coloured layer with only what the tiles need. Layers with an order column are lines.
+    columns = ['geometry', 'hexcolour'] + (['linewidth', order] if order is not None else [])
+    layer = gdf[columns].rename(columns={order: 'order'}) if order is not None else gdf[columns]
+    return {'name': name, 'gdf': layer.reset_index(drop=True), 'lines': order is not None}
+
+def pack_layer(layer):
+    # Tile layer as arrays the workers memory-map rather than copy: packed geometries, colours as codes
+    # into the layer's palette, line widths and orders, with each feature's bounds and the largest order
+    # worked out once here for every column job to filter by
+    gdf = layer['gdf']
+    geometries, rows = compact.pack_geometries(np.asarray(gdf.geometry.values), gdf.crs)
+    palette, colours = np.unique(gdf['hexcolour'].values[rows].astype(str), return_inverse=True)
+    return {
+        'name': layer['name'],
+        'lines': layer['lines'],
+        'geometries': geometries,
+        'palette': palette,
+        'colours': colours.astype(np.int32),
+        'linewidth': gdf['linewidth'].values[rows].astype(np.float32) if layer['lines'] else None,
+        'order': gdf['order'].values[rows] if layer['lines'] else None,
+        'bounds': shapely.bounds(gdf.geometry.values[rows]),
+        'maxorder': gdf['order'].max() if layer['lines'] and len(rows) else 0,
+    }
+
+def _column_layers(z, x, ys):
+    # Features of each layer under one column of tiles, with small streams filtered out for the zoom level
+    # and simplified to half a pixel. Each column only decodes and simplifies its own features, so a zoom
+    # level's simplification is done once across the workers rather than by every one of them.
+    layers, minzoom = jobs.shared()
+    tolerance = 360 / 2 ** z / TILE_SIZE / 2
+    minx, miny, maxx, _ = tile_bounds(x, ys[-1], z)
+    top = tile_bounds(x, ys[0], z)[3]
+    frames = []
+    for layer in layers:
+        bounds = layer['bounds']
+        keep = (bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx) & (bounds[:, 1] <= top) & (bounds[:, 3] >= miny)
+        if layer['lines']:
+            keep &= layer['order'] >= min_order(z, minzoom, layer['maxorder'])
+        rows = np.flatnonzero(keep)
+        geometries = shapely.simplify(compact.geometries(layer['geometries'], rows), tolerance, preserve_topology=True)
+        frames.append((layer, rows, geometries, bounds[rows]))
+    return frames, tolerance
+
+def _tile_column(job):
+    # Write every non-empty tile in one column of the pyramid, returning the number written
+    outdir, z, x, ys = job
+    frames, tolerance = _column_layers(z, x, ys)
+    written = 0
+    for y in ys:
+        minx, miny, maxx, maxy = tile_bounds(x, y, z)
+        features = []
+        for layer, rows, geometries, bounds in frames:
+            # Simplified geometries lie within the bounds of the originals, so these are the candidates
+            hits = np.flatnonzero((bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx) & (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny))
+            if len(hits) == 0:
+                continue
+            clipped = shapely.set_precision(shapely.clip_by_rect(geometries[hits], minx, miny, maxx, maxy), tolerance / 4)
+            keep = np.isin(shapely.get_type_id(clipped), compact.LINE_TYPES if layer['lines'] else compact.AREA_TYPES)
+            selected = rows[hits[keep]]
+            colours = layer['palette'][layer['colours'][selected]]
+            widths = layer['linewidth'][selected] if layer['lines'] else np.zeros(len(selected))
+            for geometry, colour, width in zip(shapely.to_geojson(clipped[keep]), colours, widths):
+                properties = json.dumps({'layer': layer['name'], 'hexcolour': colour, 'linewidth': float(width)})
+                features.append(f'{{"type":"Feature","geometry":{geometry},"properties":{properties}}}')
+        if features:
+            os.makedirs(os.path.join(outdir, str(z), str(x)), exist_ok=True)
+            with open(os.path.join(outdir, str(z), str(x), f'{y}.geojson'), 'w') as f:
+                f.write('{"type":"FeatureCollection","features":[' + ','.join(features) + ']}')
+            written += 1
+    return written
+
+def generate(layers, outdir, minzoom=6, maxzoom=12, workers=None, title='', bbox=None):
+    # Cut the layers into a z/x/y pyramid of GeoJSON tiles across a process pool, with a viewer page.
+    # The viewer covers the layers, or bbox if every layer is empty.
+    frames = [layer['gdf'] for layer in layers if len(layer['gdf'])]
+    if frames:
+        bounds = np.array([gdf.total_bounds for gdf in frames])
+        minx, miny, maxx, maxy = bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()
+    elif bbox is not None:
+        minx, miny, maxx, maxy = bbox
+    else:
+        raise ValueError(f'No features to tile in {outdir}, and no bbox to cover instead')
+    maxwidth = max([layer['gdf']['linewidth'].max() for layer in layers if layer['lines'] and len(layer['gdf'])] + [1])
+    columns = []
+    for z in range(minzoom, maxzoom + 1):
+        x0, y0 = lonlat_to_tile(minx, maxy, z)
+        x1, y1 = lonlat_to_tile(maxx, miny, z)
+        columns += [(outdir, z, x, range(y0, y1 + 1)) for x in range(x0, x1 + 1)]
+    # The workers get packed copies of the layers, which travel as memory-mapped arrays like the maps' layers
+    written = sum(jobs.run(_tile_column, columns, ([pack_layer(layer) for layer in layers], minzoom), workers).values())
+    logging.info(f'Wrote {written} tiles for zooms {minzoom}-{maxzoom} to {outdir}')
+
+    os.makedirs(outdir, exist_ok=True)
+    with open(os.path.join(outdir, 'metadata.json'), 'w') as f:
+        json.dump({
+            'minzoom': minzoom,
+            'maxzoom': maxzoom,
+            'bounds': [float(minx), float(miny), float(maxx), float(maxy)],
+            'maxlinewidth': float(maxwidth),
+            'title': title,
+        }, f)
+    with open(os.path.join(outdir, 'index.html'), 'w') as f:
+        f.write(VIEWER)
+    return written
+
+# Leaflet page that only fetches the tiles in view, drawing them onto canvases
+VIEWER = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>html, body, #map { height: 100%; margin: 0; background: #000; }</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+fetch('metadata.json').then(r => r.json()).then(meta => {
+    document.title = meta.title;
+    const map = L.map('map', {minZoom: meta.minzoom, maxZoom: meta.maxzoom + 3});
+    map.fitBounds([[meta.bounds[1], meta.bounds[0]], [meta.bounds[3], meta.bounds[2]]]);
+    const RiverTiles = L.GridLayer.extend({
+        createTile: function(coords, done) {
+            const tile = L.DomUtil.create('canvas');
+            const size = this.getTileSize();
+            tile.width = size.x;
+            tile.height = size.y;
+            const origin = coords.scaleBy(size);
+            const ctx = tile.getContext('2d');
+            const path = ring => ring.forEach((c, i) => {
+                const p = map.project([c[1], c[0]], coords.z).subtract(origin);
+                i === 0 ? ctx.moveTo(p.x, p.y) : ctx.lineTo(p.x, p.y);
+            });
+            fetch(`${coords.z}/${coords.x}/${coords.y}.geojson`).then(r => r.ok ? r.json() : {features: []}).then(data => {
+                data.features.forEach(f => {
+                    const g = f.geometry;
+                    ctx.beginPath();
+                    if (g.type === 'Polygon' || g.type === 'MultiPolygon') {
+                        (g.type === 'Polygon' ? [g.coordinates] : g.coordinates).forEach(poly => poly.forEach(path));
+                        ctx.fillStyle = f.properties.hexcolour;
+                        ctx.fill('evenodd');
+                    } else {
+                        (g.type === 'LineString' ? [g.coordinates] : g.coordinates).forEach(path);
+                        ctx.strokeStyle = f.properties.hexcolour;
+                        ctx.lineWidth = 1 + 3 * f.properties.linewidth / meta.maxlinewidth;
+                        ctx.lineCap = 'round';
+                        ctx.stroke();
+                    }
+                });
+                done(null, tile);
+            }).catch(() => done(null, tile));
+            return tile;
+        }
+    });
+    new RiverTiles({minZoom: meta.minzoom, maxNativeZoom: meta.maxzoom, maxZoom: meta.maxzoom + 3}).addTo(map);
+});
+</script>
+</body>
+</html>
+'''